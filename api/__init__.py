@@ -95,6 +95,7 @@ def create_app(test_config=None):
                 'health': '/health',
                 'streams': {
                     'list': '/api/streams',
+                    'check_all': '/api/streams/check',
                     'details': '/api/stream/<id>',
                     'check': '/api/stream/<id>/check',
                     'capture': '/api/stream/<id>/capture',
@@ -21,10 +21,18 @@ class Config:
     # Gemini AI settings
     GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY", "")
     GEMINI_MODEL_NAME = "gemini-2.0-flash"
+    GEMINI_CACHE_TTL = int(os.environ.get("GEMINI_CACHE_TTL", "600"))  # Seconds to reuse a result for an unchanged grid; 0 disables
     
     # API settings
     API_BASE_URL = os.environ.get("API_BASE_URL", "http://localhost:8000")
-    STREAMS_CACHE_TTL = int(os.environ.get("STREAMS_CACHE_TTL", "300"))  # Default 5 minutes
+    STREAMS_CACHE_TTL = int(os.environ.get("STREAMS_CACHE_TTL", "3600"))  # Safety net; stream writes invalidate the cache
+
+    # Screenshot settings
+    LOCAL_SCREENSHOT_STORAGE = os.environ.get("LOCAL_SCREENSHOT_STORAGE", "false").lower() == "true"  # Keep copies under uploads/ as well as GCS
+    SCREENSHOT_DEDUP_THRESHOLD = int(os.environ.get("SCREENSHOT_DEDUP_THRESHOLD", "5"))  # dHash bits; 0 disables
+    SCREENSHOT_MAX_DIM = int(os.environ.get("SCREENSHOT_MAX_DIM", "1280"))  # Longest side in pixels; 0 keeps full resolution
+    SCREENSHOT_BLANK_THRESHOLD = float(os.environ.get("SCREENSHOT_BLANK_THRESHOLD", "5.0"))  # Grayscale std dev; 0 disables
+    SCREENSHOT_GRID_INTERVAL = float(os.environ.get("SCREENSHOT_GRID_INTERVAL", "60"))  # Seconds between grids per stream
     
 
 class DevelopmentConfig(Config):
@@ -6,7 +6,7 @@ class RTSPStream(db.Model):
     __tablename__   = 'rtsp_stream'
 
     id              = db.Column(db.Integer, primary_key=True)
-    rtsp_url        = db.Column(db.String(255), nullable=False)
+    rtsp_url        = db.Column(db.String(255), unique=True, nullable=False, index=True)
     description     = db.Column(db.Text)
     name            = db.Column(db.String(255))
     coco_link       = db.Column(db.String(255))
@@ -5,6 +5,7 @@ from datetime import datetime
 from flask import Blueprint, request, jsonify, current_app
 from api.models import SOP, AIModel, RTSPStream
 from api import db
+from api.tasks.screenshot_processor import invalidate_sop_cache
 from sqlalchemy.exc import SQLAlchemyError
 
 sop_bp = Blueprint('sop', __name__)
@@ -232,6 +233,7 @@ def update_sop(sop_id):
                 logger.info(f"Updated SOP streams to: {[stream.id for stream in sop.rtsp_streams]}")
         
         db.session.commit()
+        invalidate_sop_cache(sop_id)
         
         return jsonify({
             'success': True,
@@ -264,6 +266,7 @@ def delete_sop(sop_id):
         sop = SOP.query.get_or_404(sop_id)
         db.session.delete(sop)
         db.session.commit()
+        invalidate_sop_cache(sop_id)
         
         return jsonify({
             'success': True,
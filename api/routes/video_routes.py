@@ -2,16 +2,21 @@ import os
 import re
 import uuid
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import cv2
 from flask import Blueprint, request, jsonify, current_app, abort, send_from_directory
 from api.models import RTSPStream, SOP
 from api import db
-from sqlalchemy.exc import SQLAlchemyError
+from api.tasks.cron_jobs import stream_manager, invalidate_streams_cache
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 
 video_bp = Blueprint('video', __name__)
 logger = logging.getLogger(__name__)
 
+# Maximum number of RTSP probes run concurrently by check_many
+MAX_PROBE_WORKERS = 32
+
 def validate_rtsp_url(url):
     """
     Validate an RTSP URL
@@ -30,6 +35,24 @@ def validate_rtsp_url(url):
     
     return bool(re.match(rtsp_pattern, url) or re.match(ip_rtsp_pattern, url))
 
+def is_rtsp_url_conflict(error):
+    """
+    Check whether an IntegrityError came from the unique index on rtsp_url
+    
+    Args:
+        error (IntegrityError): Error raised by the commit
+        
+    Returns:
+        bool: True for a duplicate rtsp_url, False for other violations (NOT NULL, foreign keys, ...)
+    """
+    # PostgreSQL reports the violated constraint by name
+    constraint = getattr(getattr(error.orig, 'diag', None), 'constraint_name', None)
+    if constraint:
+        return 'rtsp_url' in constraint
+    # Other drivers (e.g. SQLite: "UNIQUE constraint failed: rtsp_stream.rtsp_url") only give a message
+    message = str(error.orig).lower()
+    return 'unique' in message and 'rtsp_url' in message
+
 def check_rtsp_stream(url):
     """
     Check if an RTSP stream is accessible
@@ -59,6 +82,23 @@ def check_rtsp_stream(url):
         logger.error(f"Error checking RTSP stream: {str(e)}")
         return False
 
+def check_many(urls):
+    """
+    Check several RTSP streams concurrently
+    
+    Args:
+        urls (list[str]): RTSP URLs to check
+        
+    Returns:
+        dict[str, bool]: Mapping of URL to accessibility
+    """
+    if not urls:
+        return {}
+    
+    # Probes are network-bound, so threads overlap the socket waits
+    with ThreadPoolExecutor(max_workers=min(MAX_PROBE_WORKERS, len(urls))) as executor:
+        return dict(zip(urls, executor.map(check_rtsp_stream, urls)))
+
 @video_bp.route('/api/streams', methods=['GET'])
 def get_streams():
     """API endpoint to list all RTSP streams"""
@@ -83,6 +123,36 @@ def get_streams():
         logger.error(f"Unexpected error while fetching streams: {str(e)}")
         return jsonify({'success': False, 'error': 'An unexpected error occurred'}), 500
 
+@video_bp.route('/api/streams/check', methods=['GET'])
+def check_streams():
+    """API endpoint to check accessibility of all RTSP streams"""
+    try:
+        streams = RTSPStream.query.all()
+        
+        # Streams already held open by the stream manager don't need a fresh RTSP session
+        results = {
+            stream.rtsp_url: True
+            for stream in streams
+            if stream_manager.get_stream_status(stream.id)['status'] == 'running'
+        }
+        results.update(check_many([stream.rtsp_url for stream in streams if stream.rtsp_url not in results]))
+        
+        return jsonify({
+            'success': True,
+            'streams': [{
+                'id': stream.id,
+                'name': stream.name,
+                'rtsp_url': stream.rtsp_url,
+                'accessible': results.get(stream.rtsp_url, False)
+            } for stream in streams]
+        })
+    except SQLAlchemyError as e:
+        logger.error(f"Database error while checking streams: {str(e)}")
+        return jsonify({'success': False, 'error': 'Database error occurred'}), 500
+    except Exception as e:
+        logger.error(f"Unexpected error while checking streams: {str(e)}")
+        return jsonify({'success': False, 'error': 'An unexpected error occurred'}), 500
+
 @video_bp.route('/api/streams', methods=['POST'])
 def add_rtsp_stream():
     """API endpoint to add a new RTSP stream"""
@@ -106,11 +176,6 @@ def add_rtsp_stream():
         if not validate_rtsp_url(rtsp_url):
             return jsonify({'success': False, 'error': 'Invalid RTSP URL format'}), 400
         
-        # Check if stream with this URL already exists
-        existing_stream = RTSPStream.query.filter_by(rtsp_url=rtsp_url).first()
-        if existing_stream:
-            return jsonify({'success': False, 'error': 'RTSP stream with this URL already exists'}), 409
-        
         # Create new RTSP stream record
         stream = RTSPStream(
             name=name,
@@ -120,7 +185,15 @@ def add_rtsp_stream():
             created_at=datetime.now()  # Set created_at on creation
         )
         db.session.add(stream)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError as e:
+            db.session.rollback()
+            # Unique constraint on rtsp_url rejects duplicates; anything else is a real database error
+            if not is_rtsp_url_conflict(e):
+                raise
+            return jsonify({'success': False, 'error': 'RTSP stream with this URL already exists'}), 409
+        invalidate_streams_cache()
         
         return jsonify({
             'success': True,
@@ -221,7 +294,15 @@ def update_stream(stream_id):
                 stream.sops = sops
                 logger.info(f"Updated stream SOPs to: {[sop.id for sop in stream.sops]}")
         
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError as e:
+            db.session.rollback()
+            # Another request took the URL after the check above
+            if not is_rtsp_url_conflict(e):
+                raise
+            return jsonify({'success': False, 'error': 'RTSP stream with this URL already exists'}), 409
+        invalidate_streams_cache()
         logger.info(f"Successfully updated stream {stream_id}")
         
         return jsonify({
@@ -256,6 +337,7 @@ def delete_stream(stream_id):
         # Delete the stream - cascade will handle associated records
         db.session.delete(stream)
         db.session.commit()
+        invalidate_streams_cache()
         
         return jsonify({
             'success': True,
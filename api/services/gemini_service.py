@@ -3,18 +3,119 @@
 
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, Any, Set
+from typing import Awaitable, Callable, Dict, Any, Iterable, Set, TypeVar
 import os
 import logging
 import json
-import imghdr
 import time
+import random
+import asyncio
+import weakref
+from functools import lru_cache
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from flask import current_app
 from google import genai
-from google.genai import types
+from google.genai import errors, types
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar('T')
+
+# Shared HTTP session so image downloads reuse pooled keep-alive connections
+_SESSION = requests.Session()
+_SESSION.headers.update({'Connection': 'keep-alive'})
+_SESSION.mount('https://', HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=64,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+))
+
+@lru_cache(maxsize=4)
+def _get_client(api_key: str) -> genai.Client:
+    """Return a cached Gemini client so its connection pool is reused across requests."""
+    return genai.Client(api_key=api_key)
+
+# Event loop -> {api_key: async client}; entries go away with their loop
+_async_clients: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, Any]]' = weakref.WeakKeyDictionary()
+
+def _get_async_client(api_key: str):
+    """Return an async Gemini client for the running event loop.
+
+    The HTTP session behind client.aio belongs to the loop that first used it, so the
+    process-wide _get_client() client can't be shared across asyncio.run() calls.
+    """
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    if api_key not in clients:
+        clients[api_key] = genai.Client(api_key=api_key).aio
+    return clients[api_key]
+
+def _schema_key(structured_output: dict) -> str:
+    """Return a stable, hashable key for an SOP structured_output dict."""
+    return json.dumps(structured_output, sort_keys=True)
+
+_TYPE_MAP: Dict[str, types.Type] = {
+    "string": types.Type.STRING,
+    "number": types.Type.NUMBER,
+    "boolean": types.Type.BOOLEAN,
+    "array": types.Type.ARRAY,
+    "object": types.Type.OBJECT
+}
+
+def _build_schema(root: dict) -> types.Schema:
+    """Build a Gemini schema from a structured_output dict using an explicit post-order stack."""
+    built: Dict[int, types.Schema] = {}  # id(schema_dict) -> built schema
+    stack = [(root, False)]
+    while stack:
+        schema_dict, expanded = stack.pop()
+        if "type" not in schema_dict:
+            built[id(schema_dict)] = types.Schema(type=types.Type.OBJECT)
+            continue
+        schema_type = _TYPE_MAP.get(schema_dict["type"].lower(), types.Type.STRING)
+        if schema_type == types.Type.OBJECT and "properties" in schema_dict:
+            children = schema_dict["properties"].values()
+        elif schema_type == types.Type.ARRAY and "items" in schema_dict:
+            children = (schema_dict["items"],)
+        else:
+            built[id(schema_dict)] = types.Schema(type=schema_type)
+            continue
+        if not expanded:
+            # Revisit this node once all of its children have been built
+            stack.append((schema_dict, True))
+            stack.extend((child, False) for child in children)
+        elif schema_type == types.Type.OBJECT:
+            built[id(schema_dict)] = types.Schema(
+                type=schema_type,
+                properties={key: built[id(prop)] for key, prop in schema_dict["properties"].items()},
+                required=schema_dict.get("required", [])
+            )
+        else:
+            built[id(schema_dict)] = types.Schema(
+                type=schema_type,
+                items=built[id(schema_dict["items"])]
+            )
+    return built[id(root)]
+
+@lru_cache(maxsize=128)
+def _schema_from_key(schema_key: str) -> types.Schema:
+    """Build (once per distinct SOP schema) the Gemini schema for structured_output."""
+    return _build_schema(json.loads(schema_key))
+
+@lru_cache(maxsize=128)
+def _get_content_config(temperature: float, schema_key: str, timeout_seconds: float, batched: bool = False) -> types.GenerateContentConfig:
+    """Return a cached JSON generation config for an SOP schema, optionally wrapped in an array for batches."""
+    response_schema = _schema_from_key(schema_key)
+    if batched:
+        response_schema = types.Schema(type=types.Type.ARRAY, items=response_schema)
+    return types.GenerateContentConfig(
+        temperature=temperature,
+        response_mime_type="application/json",
+        response_schema=response_schema,
+        # The client has no request timeout of its own; HttpOptions takes milliseconds
+        http_options=types.HttpOptions(timeout=int(timeout_seconds * 1000)),
+    )
+
 class GeminiConfigError(Exception):
     """Raised when there's an issue with Gemini configuration."""
     pass
@@ -34,6 +135,9 @@ class GeminiConfig:
     model_name: str = "gemini-2.0-flash"
     temperature: float = 1.0
     timeout_seconds: int = 30  # Default timeout of 30 seconds
+    max_attempts: int = 5  # Attempts per call when Gemini is rate limited or unavailable
+    retry_initial_delay: float = 1.0  # seconds
+    retry_max_delay: float = 30.0  # seconds
 
     @classmethod
     def from_app_config(cls) -> 'GeminiConfig':
@@ -48,48 +152,63 @@ class GeminiConfig:
 class GeminiService:
     """Service for interacting with Google's Gemini API."""
     
-    SUPPORTED_IMAGE_TYPES: Set[str] = {'jpeg', 'jpg', 'png', 'gif', 'bmp'}
-    MIME_TYPE_MAP: Dict[str, str] = {
-        'jpeg': 'image/jpeg',
-        'jpg': 'image/jpeg',
-        'png': 'image/png',
-        'gif': 'image/gif',
-        'bmp': 'image/bmp'
+    IMAGE_SIGNATURES: Dict[bytes, str] = {
+        b'\x89PNG': 'image/png',
+        b'GIF8': 'image/gif',
+        b'\xff\xd8\xff': 'image/jpeg',
+        b'BM': 'image/bmp'
     }
+    HEADER_SIZE: int = 4  # Longest signature prefix in IMAGE_SIGNATURES
+    RETRYABLE_STATUS_CODES: Set[int] = {429, 500, 502, 503, 504}
+    MAX_BATCH_SIZE: int = 16  # Maximum images sent in a single batched request
 
     def __init__(self, config: GeminiConfig):
         """Initialize the Gemini service."""
         self.config = config
-        self.client = genai.Client(api_key=config.api_key)
+        self.client = _get_client(config.api_key)
+
+    def _sniff_mime_type(self, head: bytes, source: str) -> str:
+        """Detect an image's MIME type from its first HEADER_SIZE bytes."""
+        mime_type = (
+            self.IMAGE_SIGNATURES.get(head)
+            or self.IMAGE_SIGNATURES.get(head[:3])
+            or self.IMAGE_SIGNATURES.get(head[:2])
+        )
+        if mime_type:
+            return mime_type
+        raise GeminiAnalysisError(
+            f"Unsupported or invalid image file: {source}. "
+            f"Supported types are: {', '.join(sorted(set(self.IMAGE_SIGNATURES.values())))}"
+        )
 
-    def _validate_image(self, image_path: Path) -> tuple[str, str]:
-        if not image_path.exists():
+    def _read_and_sniff(self, image_path: Path) -> tuple[bytes, str]:
+        """Read a local image in one pass and detect its MIME type from magic bytes."""
+        try:
+            with open(image_path, "rb") as image_file:
+                head = image_file.read(self.HEADER_SIZE)
+                rest = image_file.read()
+        except FileNotFoundError:
             raise GeminiAnalysisError(f"Image file not found: {image_path}")
-        image_type = imghdr.what(image_path)
-        if not image_type:
-            raise GeminiAnalysisError(f"File is not a valid image: {image_path}")
-        if image_type not in self.SUPPORTED_IMAGE_TYPES:
-            raise GeminiAnalysisError(
-                f"Unsupported image type: {image_type}. "
-                f"Supported types are: {', '.join(self.SUPPORTED_IMAGE_TYPES)}"
-            )
-        return image_type, self.MIME_TYPE_MAP[image_type]
+        return head + rest, self._sniff_mime_type(head, str(image_path))
 
-    def _read_image(self, image_path: Path | str) -> tuple[bytes, str]:
+    def _read_image(self, image_path: Path | str | bytes) -> tuple[bytes, str]:
         """
-        Read image data from either a local file path or GCS URL.
+        Read image data from a local file path, a GCS URL or an in-memory buffer.
         
         Args:
-            image_path: Path to local file or GCS URL
+            image_path: Path to local file, GCS URL or encoded image bytes
             
         Returns:
             tuple[bytes, str]: Image data and MIME type
         """
         try:
+            # Handle encoded bytes already in memory
+            if isinstance(image_path, (bytes, bytearray)):
+                return bytes(image_path), self._sniff_mime_type(bytes(image_path[:self.HEADER_SIZE]), "in-memory image")
+            
             # Handle GCS URL
             if isinstance(image_path, str) and image_path.startswith('https://storage.googleapis.com/'):
-                import requests
-                response = requests.get(image_path)
+                response = _SESSION.get(image_path, timeout=self.config.timeout_seconds)
                 response.raise_for_status()
                 image_data = response.content
                 # Determine MIME type from content-type header or file extension
@@ -97,53 +216,82 @@ class GeminiService:
                 return image_data, mime_type
             
             # Handle local file path
-            image_path = Path(image_path)
-            _, mime_type = self._validate_image(image_path)
-            with open(image_path, "rb") as image_file:
-                return image_file.read(), mime_type
+            return self._read_and_sniff(Path(image_path))
         except Exception as e:
             raise GeminiAnalysisError(f"Failed to read image file: {e}")
 
     def _create_schema_from_sop(self, structured_output: dict) -> types.Schema:
         """Convert SOP structured_output to Gemini schema."""
-        def convert_type_to_gemini_type(type_str: str) -> types.Type:
-            type_map = {
-                "string": types.Type.STRING,
-                "number": types.Type.NUMBER,
-                "boolean": types.Type.BOOLEAN,
-                "array": types.Type.ARRAY,
-                "object": types.Type.OBJECT
-            }
-            return type_map.get(type_str.lower(), types.Type.STRING)
-
-        def build_schema(schema_dict: dict) -> types.Schema:
-            if "type" not in schema_dict:
-                return types.Schema(type=types.Type.OBJECT)
-            schema_type = convert_type_to_gemini_type(schema_dict["type"])
-            if schema_type == types.Type.OBJECT and "properties" in schema_dict:
-                properties = {
-                    key: build_schema(prop)
-                    for key, prop in schema_dict["properties"].items()
-                }
-                return types.Schema(
-                    type=schema_type,
-                    properties=properties,
-                    required=schema_dict.get("required", [])
+        return _schema_from_key(_schema_key(structured_output))
+
+    def _build_contents(self, image_path: str | Path, prompt: str) -> list[types.Content]:
+        """Read an image and build the single-turn request contents for it."""
+        # Only convert to Path if it's a local file path
+        if isinstance(image_path, str) and not image_path.startswith('https://storage.googleapis.com/'):
+            image_path = Path(image_path)
+        image_bytes, mime_type = self._read_image(image_path)
+        return [
+            types.Content(
+                role="user",
+                parts=[
+                    types.Part(
+                        inline_data=types.Blob(
+                            mime_type=mime_type,
+                            data=image_bytes
+                        )
+                    ),
+                    types.Part(text=prompt)
+                ],
+            ),
+        ]
+
+    def _retry_delay(self, attempt: int, error: errors.APIError) -> float:
+        """Seconds to wait before the next attempt, honouring Retry-After when Gemini sends it."""
+        headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+        retry_after = headers.get('Retry-After')
+        if retry_after:
+            try:
+                return min(float(retry_after), self.config.retry_max_delay)
+            except ValueError:
+                pass
+        delay = min(self.config.retry_initial_delay * (2 ** attempt), self.config.retry_max_delay)
+        return random.uniform(delay / 2, delay)
+
+    def _call_with_retry(self, call: Callable[[], T]) -> T:
+        """Run a Gemini call, retrying rate-limit (429) and 5xx errors with exponential backoff."""
+        for attempt in range(self.config.max_attempts):
+            try:
+                return call()
+            except errors.APIError as api_error:
+                if api_error.code not in self.RETRYABLE_STATUS_CODES or attempt == self.config.max_attempts - 1:
+                    raise
+                delay = self._retry_delay(attempt, api_error)
+                logger.warning(
+                    f"Gemini returned {api_error.code}, retrying in {delay:.1f}s "
+                    f"(attempt {attempt + 1}/{self.config.max_attempts})"
                 )
-            elif schema_type == types.Type.ARRAY and "items" in schema_dict:
-                return types.Schema(
-                    type=schema_type,
-                    items=build_schema(schema_dict["items"])
+                time.sleep(delay)
+
+    async def _call_with_retry_async(self, call: Callable[[], Awaitable[T]]) -> T:
+        """Async counterpart of _call_with_retry."""
+        for attempt in range(self.config.max_attempts):
+            try:
+                return await call()
+            except errors.APIError as api_error:
+                if api_error.code not in self.RETRYABLE_STATUS_CODES or attempt == self.config.max_attempts - 1:
+                    raise
+                delay = self._retry_delay(attempt, api_error)
+                logger.warning(
+                    f"Gemini returned {api_error.code}, retrying in {delay:.1f}s "
+                    f"(attempt {attempt + 1}/{self.config.max_attempts})"
                 )
-            else:
-                return types.Schema(type=schema_type)
-        return build_schema(structured_output)
+                await asyncio.sleep(delay)
 
-    def analyze_image_with_sop(self, image_path: str | Path, sop: 'SOP') -> dict:
+    def analyze_image_with_sop(self, image_path: str | Path | bytes, sop: 'SOP') -> dict:
         """
         Analyze an image using Google Gemini according to SOP's structured output schema.
         Args:
-            image_path: Path to the image file or GCS URL
+            image_path: Path to the image file, GCS URL or encoded image bytes
             sop: SOP model instance containing the prompt and structured_output schema
         Returns:
             dict: Structured analysis result matching the SOP's schema
@@ -153,44 +301,33 @@ class GeminiService:
             GeminiTimeoutError: If the API call times out
         """
         try:
-            logger.info(f"Starting analysis for image: {image_path}")
-            # Only convert to Path if it's a local file path
-            if isinstance(image_path, str) and not image_path.startswith('https://storage.googleapis.com/'):
-                image_path = Path(image_path)
-            image_bytes, mime_type = self._read_image(image_path)
-            contents = [
-                types.Content(
-                    role="user",
-                    parts=[
-                        types.Part(
-                            inline_data=types.Blob(
-                                mime_type=mime_type,
-                                data=image_bytes
-                            )
-                        ),
-                        types.Part(text=sop.prompt)
-                    ],
-                ),
-            ]
-            response_schema = self._create_schema_from_sop(sop.structured_output)
-            generate_content_config = types.GenerateContentConfig(
-                temperature=self.config.temperature,
-                response_mime_type="application/json",
-                response_schema=response_schema,
+            source = f"{len(image_path)}-byte buffer" if isinstance(image_path, (bytes, bytearray)) else image_path
+            logger.info(f"Starting analysis for image: {source}")
+            contents = self._build_contents(image_path, sop.prompt)
+            generate_content_config = _get_content_config(
+                self.config.temperature, _schema_key(sop.structured_output), self.config.timeout_seconds
             )
-            try:
-                full_output = ""
-                start_time = time.time()
+
+            def stream_once() -> str:
+                chunks: list[str] = []
+                deadline = time.monotonic() + self.config.timeout_seconds
                 response_chunks = self.client.models.generate_content_stream(
                     model=self.config.model_name,
                     contents=contents,
                     config=generate_content_config,
                 )
                 for chunk in response_chunks:
-                    if time.time() - start_time > self.config.timeout_seconds:
+                    if time.monotonic() > deadline:
                         raise GeminiTimeoutError(f"API call timed out after {self.config.timeout_seconds} seconds")
-                    full_output += chunk.text
-                result = json.loads(full_output)
+                    if chunk.text:
+                        chunks.append(chunk.text)
+                    # Stop reading as soon as Gemini marks the response finished
+                    if chunk.candidates and chunk.candidates[0].finish_reason:
+                        break
+                return "".join(chunks)
+
+            try:
+                result = json.loads(self._call_with_retry(stream_once))
                 return result
             except Exception as api_error:
                 error_msg = str(api_error)
@@ -201,3 +338,114 @@ class GeminiService:
         except Exception as e:
             logger.error(f"Analysis failed: {str(e)}")
             raise GeminiAnalysisError(f"Failed to analyze image: {str(e)}")
+
+    def analyze_images_with_sop(self, image_paths: list[str | Path | bytes], sop: 'SOP') -> list[dict]:
+        """
+        Analyze several images with a single Gemini request per batch.
+        Args:
+            image_paths: Paths to the image files, GCS URLs or encoded image bytes
+            sop: SOP model instance containing the prompt and structured_output schema
+        Returns:
+            list[dict]: One structured analysis result per image, in input order
+        Raises:
+            GeminiConfigError: If there's an issue with the configuration
+            GeminiAnalysisError: If there's an error during analysis
+        """
+        if not image_paths:
+            return []
+        try:
+            generate_content_config = _get_content_config(
+                self.config.temperature, _schema_key(sop.structured_output), self.config.timeout_seconds, batched=True
+            )
+            results = []
+            for start in range(0, len(image_paths), self.MAX_BATCH_SIZE):
+                batch = image_paths[start:start + self.MAX_BATCH_SIZE]
+                logger.info(f"Starting batched analysis for {len(batch)} images")
+                parts = []
+                for i, image_path in enumerate(batch):
+                    if isinstance(image_path, str) and not image_path.startswith('https://storage.googleapis.com/'):
+                        image_path = Path(image_path)
+                    image_bytes, mime_type = self._read_image(image_path)
+                    parts.append(types.Part(text=f"[IMAGE {i}]"))
+                    parts.append(types.Part(inline_data=types.Blob(mime_type=mime_type, data=image_bytes)))
+                parts.append(types.Part(
+                    text=f"{sop.prompt}\n\nReturn a JSON array with exactly one result per image, "
+                         f"in the same order as the [IMAGE n] markers."
+                ))
+                try:
+                    response = self._call_with_retry(lambda: self.client.models.generate_content(
+                        model=self.config.model_name,
+                        contents=[types.Content(role="user", parts=parts)],
+                        config=generate_content_config,
+                    ))
+                except Exception as api_error:
+                    error_msg = str(api_error)
+                    logger.error(f"API Error: {error_msg}")
+                    if "deprecated" in error_msg.lower():
+                        raise GeminiConfigError(f"Model {self.config.model_name} is deprecated. Please update to gemini-1.5-flash or newer.")
+                    raise
+                batch_results = json.loads(response.text)
+                if not isinstance(batch_results, list) or len(batch_results) != len(batch):
+                    raise GeminiAnalysisError(
+                        f"Expected {len(batch)} results, got "
+                        f"{len(batch_results) if isinstance(batch_results, list) else type(batch_results).__name__}"
+                    )
+                results.extend(batch_results)
+            return results
+        except GeminiConfigError:
+            raise
+        except Exception as e:
+            logger.error(f"Batched analysis failed: {str(e)}")
+            raise GeminiAnalysisError(f"Failed to analyze images: {str(e)}")
+
+    async def analyze_image_with_sop_async(self, image_path: str | Path, sop: 'SOP') -> dict:
+        """
+        Analyze an image like analyze_image_with_sop, using the async Gemini client.
+        Each event loop gets its own client, so separate asyncio.run() calls are safe.
+        Args:
+            image_path: Path to the image file or GCS URL
+            sop: SOP model instance containing the prompt and structured_output schema
+        Returns:
+            dict: Structured analysis result matching the SOP's schema
+        Raises:
+            GeminiAnalysisError: If there's an error during analysis
+            GeminiTimeoutError: If the API call times out
+        """
+        try:
+            logger.info(f"Starting async analysis for image: {image_path}")
+            # Image download/read is blocking I/O, keep it off the event loop
+            contents = await asyncio.to_thread(self._build_contents, image_path, sop.prompt)
+            generate_content_config = _get_content_config(
+                self.config.temperature, _schema_key(sop.structured_output), self.config.timeout_seconds
+            )
+            response = await self._call_with_retry_async(lambda: asyncio.wait_for(
+                _get_async_client(self.config.api_key).models.generate_content(
+                    model=self.config.model_name,
+                    contents=contents,
+                    config=generate_content_config,
+                ),
+                timeout=self.config.timeout_seconds
+            ))
+            return json.loads(response.text)
+        except asyncio.TimeoutError:
+            raise GeminiTimeoutError(f"API call timed out after {self.config.timeout_seconds} seconds")
+        except Exception as e:
+            logger.error(f"Async analysis failed: {str(e)}")
+            raise GeminiAnalysisError(f"Failed to analyze image: {str(e)}")
+
+    async def analyze_many(self, items: Iterable[tuple[str | Path, 'SOP']], concurrency: int = 8) -> list[dict | Exception]:
+        """
+        Analyze many (image, SOP) pairs concurrently on the async Gemini client.
+        Args:
+            items: (image_path, sop) pairs to analyze
+            concurrency: Maximum number of requests in flight at once
+        Returns:
+            list[dict | Exception]: Result or raised exception for each pair, in input order
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(image_path, sop):
+            async with semaphore:
+                return await self.analyze_image_with_sop_async(image_path, sop)
+
+        return await asyncio.gather(*(run(image_path, sop) for image_path, sop in items), return_exceptions=True)
@@ -1,104 +1,164 @@
 import logging
 import time
-import requests
-from collections import defaultdict
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, as_completed
+from apscheduler.events import EVENT_JOB_MAX_INSTANCES, EVENT_JOB_MISSED
 from flask import current_app
+from sqlalchemy.exc import SQLAlchemyError
 
 from api.tasks.stream_manager import StreamManager
-from api.tasks.screenshot_processor import ScreenshotProcessor
+from api.tasks.screenshot_processor import get_screenshot_processor
 from api.utils.gcs_utils import GCSUtils
-from api.utils.api_utils import get_api_url
+from api.models.models import RTSPStream
 
 logger = logging.getLogger(__name__)
 # Grid dimensions
 GRID_ROWS = 2
 GRID_COLS = 3
+# Screenshot worker pool
+MAX_SCREENSHOT_WORKERS = 32
+SCREENSHOT_TICK_TIMEOUT = 9  # seconds, stays inside the 10 second schedule
+MAX_STARTUP_WORKERS = 16  # Streams started concurrently by initialize_streams
+# Stream restart backoff
+RESTART_BASE_DELAY = 2  # seconds before the first restart attempt, doubled after each failure
+RESTART_MAX_DELAY = 60  # seconds, upper bound on the restart backoff
 
 # Cache for streams
 streams_cache = {
     'streams': [],
     'last_updated': 0,
+    'version': 0,  # _streams_version the cached list was loaded at
+    'refreshing': False,  # A background TTL refresh is running
     'ttl': None  # Will be set from config when first used
 }
+_streams_version = 0  # Bumped whenever a stream is created, updated or deleted
 
-gcs_utils = GCSUtils()
 stream_manager = StreamManager()
 screenshot_processor = None
 
-def get_streams():
-    """Get streams from cache or API"""
-    current_time = time.time()
-    
-    # Initialize TTL from config if not set
-    if streams_cache['ttl'] is None:
-        streams_cache['ttl'] = current_app.config.get('STREAMS_CACHE_TTL', 300)
-    
-    # Return cached streams if they're still valid
-    if (current_time - streams_cache['last_updated']) < streams_cache['ttl']:
-        return streams_cache['streams']
-    
+_EXECUTOR = ThreadPoolExecutor(max_workers=MAX_SCREENSHOT_WORKERS, thread_name_prefix='screenshots')
+_in_flight = {}  # stream_id -> future still running from an earlier tick
+_in_flight_lock = threading.Lock()
+_restarting = set()  # stream ids with a restart scheduled or running
+_restarting_lock = threading.Lock()
+
+def invalidate_streams_cache():
+    """Mark the cached stream list stale so the next get_streams() reloads it"""
+    global _streams_version
+    _streams_version += 1
+
+def _load_streams(version):
+    """Query the streams from the database into the cache, keeping the old list on error"""
     try:
-        # Get streams from API
-        api_url = get_api_url('/api/streams')
-        logger.info(f"Fetching streams from API: {api_url}")
-        
-        response = requests.get(api_url)
-        
-        if not response.ok:
-            error_msg = f"API request failed with status {response.status_code}"
-            try:
-                error_detail = response.json()
-                error_msg += f": {error_detail}"
-            except:
-                error_msg += f": {response.text}"
-            logger.error(error_msg)
-            return streams_cache['streams']  # Return cached streams on error
-        
-        data = response.json()
-        if 'streams' not in data:
-            logger.error(f"Invalid API response format. Expected 'streams' key. Got: {data}")
-            return streams_cache['streams']
-            
-        streams = data['streams']
+        # Only the columns the cron jobs need
+        rows = RTSPStream.query.with_entities(RTSPStream.id, RTSPStream.name, RTSPStream.rtsp_url).all()
+        streams = [{'id': row.id, 'name': row.name, 'rtsp_url': row.rtsp_url} for row in rows]
         if not streams:
             logger.warning("No streams found in the database. Please add streams through the API.")
         else:
-            logger.info(f"Successfully fetched {len(streams)} streams from API")
+            logger.info(f"Successfully fetched {len(streams)} streams from the database")
         
         # Update cache
         streams_cache['streams'] = streams
-        streams_cache['last_updated'] = current_time
-        return streams_cache['streams']
-        
-    except requests.exceptions.ConnectionError as e:
-        logger.error(f"Failed to connect to API server: {str(e)}")
-        return streams_cache['streams']
-    except requests.exceptions.Timeout as e:
-        logger.error(f"API request timed out: {str(e)}")
-        return streams_cache['streams']
-    except requests.exceptions.RequestException as e:
-        logger.error(f"API request failed: {str(e)}")
-        return streams_cache['streams']
+        streams_cache['last_updated'] = time.time()
+        streams_cache['version'] = version
+    except SQLAlchemyError as e:
+        logger.error(f"Database error while fetching streams: {str(e)}")
     except Exception as e:
         logger.error(f"Unexpected error while fetching streams: {str(e)}")
-        return streams_cache['streams']  # Return cached streams on error
+    return streams_cache['streams']  # Cached streams on error
+
+def _refresh_streams(app, version):
+    """Reload the stream cache on a background thread"""
+    try:
+        with app.app_context():
+            _load_streams(version)
+    finally:
+        streams_cache['refreshing'] = False
+
+def get_streams():
+    """Get streams from cache or the database"""
+    current_time = time.time()
+    
+    # Initialize TTL from config if not set
+    if streams_cache['ttl'] is None:
+        streams_cache['ttl'] = current_app.config.get('STREAMS_CACHE_TTL', 3600)
+    
+    # A stream changed (or nothing is loaded yet): reload now so callers never act on deleted streams
+    version = _streams_version
+    if streams_cache['version'] != version or not streams_cache['last_updated']:
+        return _load_streams(version)
+    
+    # Only the safety-net TTL expired: serve the cached list and refresh it in the background
+    if (current_time - streams_cache['last_updated']) >= streams_cache['ttl'] and not streams_cache['refreshing']:
+        streams_cache['refreshing'] = True
+        app = current_app._get_current_object()
+        threading.Thread(target=_refresh_streams, args=(app, version), daemon=True).start()
+    return streams_cache['streams']
+
+def _start_with_retry(stream):
+    """Start a single stream, retrying once after a short delay"""
+    try:
+        success = stream_manager.start_stream(stream['id'], stream['rtsp_url'])
+        if not success:
+            logger.error(f"Failed to initialize stream: {stream['name']}")
+            # Try to restart the stream after a delay
+            time.sleep(2)
+            success = stream_manager.start_stream(stream['id'], stream['rtsp_url'])
+            if not success:
+                logger.error(f"Failed to initialize stream after retry: {stream['name']}")
+        return success
+    except Exception as e:
+        logger.error(f"Error initializing stream {stream['name']}: {e}")
+        return False
 
 def initialize_streams(app):
     """Start all RTSP streams in memory"""
     with app.app_context():
         streams = get_streams()
-        for stream in streams:
-            try:
-                success = stream_manager.start_stream(stream['id'], stream['rtsp_url'])
-                if not success:
-                    logger.error(f"Failed to initialize stream: {stream['name']}")
-                    # Try to restart the stream after a delay
-                    time.sleep(2)
-                    success = stream_manager.start_stream(stream['id'], stream['rtsp_url'])
-                    if not success:
-                        logger.error(f"Failed to initialize stream after retry: {stream['name']}")
-            except Exception as e:
-                logger.error(f"Error initializing stream {stream['name']}: {e}")
+    if not streams:
+        return
+    # Each start waits on its own RTSP handshake and HLS check, so run them side by side
+    with ThreadPoolExecutor(max_workers=min(MAX_STARTUP_WORKERS, len(streams)), thread_name_prefix='stream-startup') as executor:
+        results = list(executor.map(_start_with_retry, streams))
+    logger.info(f"Started {sum(results)} of {len(streams)} streams")
+
+def _schedule_restart(app, stream, attempt=0):
+    """
+    Restart a stream on a timer thread, backing off exponentially after each failure.
+    
+    Args:
+        app: Flask application used to push an app context
+        stream: Stream dict with id, name and rtsp_url
+        attempt: Number of failed restart attempts so far
+    """
+    delay = min(RESTART_MAX_DELAY, RESTART_BASE_DELAY * 2 ** attempt)
+    timer = threading.Timer(delay, _restart_stream, args=(app, stream, attempt))
+    timer.daemon = True
+    timer.start()
+
+def _restart_stream(app, stream, attempt):
+    """Stop and start one stream, rescheduling itself if the start fails"""
+    try:
+        with app.app_context():
+            # The stream may have been deleted or edited while we were waiting
+            current = next((s for s in get_streams() if s['id'] == stream['id']), None)
+        if current is None:
+            logger.info(f"Stream {stream['name']} was removed, dropping restart")
+        else:
+            stream_manager.stop_stream(current['id'])
+            if stream_manager.start_stream(current['id'], current['rtsp_url']):
+                logger.info(f"Restarted stream {current['name']} after {attempt + 1} attempt(s)")
+            else:
+                logger.error(f"Restart attempt {attempt + 1} failed for stream {current['name']}")
+                _schedule_restart(app, current, attempt + 1)
+                return
+    except Exception as e:
+        logger.error(f"Error restarting stream {stream['name']}: {e}")
+        _schedule_restart(app, stream, attempt + 1)
+        return
+    with _restarting_lock:
+        _restarting.discard(stream['id'])
 
 def verify_streams(app):
     """Verify all streams are running properly"""
@@ -106,52 +166,92 @@ def verify_streams(app):
         streams = get_streams()
         for stream in streams:
             try:
+                with _restarting_lock:
+                    if stream['id'] in _restarting:
+                        continue
                 status = stream_manager.get_stream_status(stream['id'])
                 if status["status"] != "running":
-                    logger.error(f"Stream {stream['name']} not running (status: {status['status']}), attempting restart")
-                    stream_manager.stop_stream(stream['id'])
-                    time.sleep(2)
-                    stream_manager.start_stream(stream['id'], stream['rtsp_url'])
+                    logger.error(f"Stream {stream['name']} not running (status: {status['status']}), scheduling restart")
+                    with _restarting_lock:
+                        _restarting.add(stream['id'])
+                    _schedule_restart(app, stream)
             except Exception as e:
                 logger.error(f"Error verifying stream {stream['name']}: {e}")
 
+def _process_one(app, stream):
+    """Capture and process the latest frame for a single stream, returning False on failure"""
+    with app.app_context():
+        try:
+            status = stream_manager.get_stream_status(stream['id'])
+            if status["status"] != "running":
+                logger.error(f"Skipping screenshot for {stream['name']} - stream not running (status: {status['status']})")
+                return
+
+            frame_bytes = stream_manager.get_latest_frame(stream['id'])
+            if frame_bytes is None:
+                logger.warning(f"No frame available for stream {stream['name']}")
+                return
+
+            # Process the screenshot with grid dimensions
+            return screenshot_processor.process_screenshot(
+                stream_id=stream['id'],
+                stream_name=stream['name'],
+                frame_bytes=frame_bytes,
+                grid_rows=GRID_ROWS,  
+                grid_cols=GRID_COLS,
+            )
+        except Exception as e:
+            logger.error(f"Error processing screenshot for stream {stream['name']}: {e}")
+        finally:
+            with _in_flight_lock:
+                _in_flight.pop(stream['id'], None)
+
 def screenshots(app):
     """Capture latest frame from memory and upload every 10 seconds"""
     with app.app_context():
-        global screenshot_processor
-        if screenshot_processor is None:
-            store_locally = app.config.get('LOCAL_SCREENSHOT_STORAGE', True)
-            # Re-instantiate ScreenshotProcessor with the correct flag
-            # (Singleton pattern will ensure only one instance is used)
-            screenshot_processor_instance = ScreenshotProcessor(gcs_utils, screenshots_per_grid=GRID_ROWS * GRID_COLS, store_locally=store_locally)
-            screenshot_processor = screenshot_processor_instance
+        # Write analysis results finished since the last tick in one batch
+        screenshot_processor.flush_analysis_records()
         streams = get_streams()
-        
+    
+    futures = {}
+    with _in_flight_lock:
         for stream in streams:
-            try:
-                status = stream_manager.get_stream_status(stream['id'])
-                if status["status"] != "running":
-                    logger.error(f"Skipping screenshot for {stream['name']} - stream not running (status: {status['status']})")
-                    continue
-
-                frame_path = stream_manager.get_latest_frame(stream['id'])
-                if frame_path is None:
-                    logger.warning(f"No frame available for stream {stream['name']}")
-                    continue
-
-                # Process the screenshot with grid dimensions
-                success = screenshot_processor.process_screenshot(
-                    stream_id=stream['id'],
-                    stream_name=stream['name'],
-                    frame_path=frame_path,
-                    grid_rows=GRID_ROWS,  
-                    grid_cols=GRID_COLS,
-                )
-                
-                if not success:
-                    logger.error(f"Failed to process screenshot for stream {stream['name']}")
-            except Exception as e:
-                logger.error(f"Error processing screenshot for stream {stream['name']}: {e}")
+            if stream['id'] in _in_flight:
+                logger.warning(f"Skipping screenshot for {stream['name']} - previous capture still running")
+                continue
+            future = _EXECUTOR.submit(_process_one, app, stream)
+            _in_flight[stream['id']] = future
+            futures[future] = stream
+    
+    # Don't block the next tick on slow streams; they finish in the background
+    try:
+        for future in as_completed(futures, timeout=SCREENSHOT_TICK_TIMEOUT):
+            if future.result() is False:
+                logger.error(f"Failed to process screenshot for stream {futures[future]['name']}")
+    except TimeoutError:
+        for future, stream in futures.items():
+            if not future.done():
+                logger.warning(f"Screenshot for stream {stream['name']} exceeded {SCREENSHOT_TICK_TIMEOUT}s deadline")
+
+def create_screenshot_processor(app):
+    """Build the ScreenshotProcessor from app config; called once when the jobs are registered"""
+    return get_screenshot_processor(
+        GCSUtils.get(),  # Built here, not at import, so importing the jobs needs no GCS env or credentials
+        screenshots_per_grid=GRID_ROWS * GRID_COLS,
+        store_locally=app.config.get('LOCAL_SCREENSHOT_STORAGE', False),
+        dedup_threshold=app.config.get('SCREENSHOT_DEDUP_THRESHOLD', 5),
+        blank_threshold=app.config.get('SCREENSHOT_BLANK_THRESHOLD', 5.0),
+        grid_interval=app.config.get('SCREENSHOT_GRID_INTERVAL', 60.0),
+        analysis_cache_ttl=app.config.get('GEMINI_CACHE_TTL', 600),
+    )
+
+def log_skipped_job(event):
+    """Log cron ticks that APScheduler dropped instead of running late or overlapping"""
+    if event.code == EVENT_JOB_MISSED:
+        reason = "run time passed the misfire grace period"
+    else:
+        reason = "previous run still in progress"
+    logger.warning(f"Skipped scheduled run of job '{event.job_id}': {reason}")
 
 def register_cron_jobs(scheduler, app):
     """Register cron jobs with proper error handling"""
@@ -160,7 +260,11 @@ def register_cron_jobs(scheduler, app):
         if any(job.id == 'screenshots' for job in existing_jobs):
             return
 
+        global screenshot_processor
+        screenshot_processor = create_screenshot_processor(app)
+        stream_manager.frame_max_dim = app.config.get('SCREENSHOT_MAX_DIM', 1280)
         initialize_streams(app)
+        scheduler.add_listener(log_skipped_job, EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES)
 
         # Verify streams every minute
         scheduler.add_job(
@@ -169,7 +273,10 @@ def register_cron_jobs(scheduler, app):
             trigger="interval",
             seconds=60,
             id='verify_streams',
-            replace_existing=True
+            replace_existing=True,
+            coalesce=True,
+            max_instances=1,
+            misfire_grace_time=30
         )
 
         # Take screenshots every 10 seconds
@@ -179,7 +286,10 @@ def register_cron_jobs(scheduler, app):
             trigger="interval",
             seconds=10,
             id='screenshots',
-            replace_existing=True
+            replace_existing=True,
+            coalesce=True,
+            max_instances=1,
+            misfire_grace_time=5
         )
     except Exception as e:
         logger.error(f"Failed to register cron jobs: {e}")
@@ -1,51 +1,280 @@
+import json
 import logging
 import os
-import shutil
+import queue
+import threading
+import time
 import requests
+from functools import lru_cache
 from datetime import datetime
-from collections import defaultdict
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from requests.adapters import HTTPAdapter
 from urllib.parse import urlparse
 from flask import current_app
-import tempfile
+from typing import Optional
+import cv2
+import numpy as np
+from PIL import Image
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 
-from api.utils.gcs_utils import GCSUtils
+from api.utils.gcs_utils import GCSUtils, reverse_timestamp_key, screenshot_prefix
 from api.utils.api_utils import get_api_url
-from api.tasks.stitcher import process_images
+from api.tasks.stitcher import LABEL_MARGIN, encode_grid, process_images
 from api.services.gemini_service import GeminiService, GeminiConfig
-from api.models.models import SOP
+from api.database import db
+from api.models.models import SOP, Analysis
 
 logger = logging.getLogger(__name__)
 
-class ScreenshotProcessor:
-    _instance = None
-    _initialized = False
+# Number of background threads sending batched Gemini grid requests
+ANALYSIS_WORKERS = 4
+# Number of background threads stitching and uploading grids
+GRID_WORKERS = 4
+# Frames smaller than this many bytes are treated as truncated and skipped
+MIN_FRAME_BYTES = 1024
+# Gemini results kept for reuse when the same SOP sees an unchanged grid
+ANALYSIS_CACHE_SIZE = 512
+# Seconds an SOP's prompt and schema are reused before they're read from the database again
+SOP_CACHE_TTL = 300
+# Grids for the same SOP queued within GRID_BATCH_WINDOW seconds share one Gemini request
+GRID_BATCH_SIZE = 4
+GRID_BATCH_WINDOW = 0.2
+# Timeout in seconds for calls to our own API
+API_TIMEOUT = 5
+# Flushes an analysis row may fail (other than on an integrity error) before it is dropped
+MAX_FLUSH_ATTEMPTS = 5
+# Queued analysis rows kept while the database is unavailable; the oldest are dropped beyond this
+MAX_PENDING_ANALYSES = 1000
+
+# Keep-alive session for internal API calls so each grid doesn't open a new connection
+_SESSION = requests.Session()
+_SESSION.headers['Connection'] = 'keep-alive'
+for _prefix in ('http://', 'https://'):
+    _SESSION.mount(_prefix, HTTPAdapter(pool_connections=10, pool_maxsize=20))
+# Local copies are kept here when store_locally is enabled
+LOCAL_SCREENSHOT_DIR = os.path.join('uploads', 'screenshots')
+LOCAL_GRID_DIR = os.path.join('uploads', 'grids')
+
+@dataclass(frozen=True)
+class SOPSnapshot:
+    """Detached copy of the SOP fields Gemini analysis needs, safe to share across threads."""
+    id: int
+    prompt: str
+    structured_output: dict
+    fingerprint: str  # Changes whenever the prompt or schema does; part of the analysis cache key
+
+_sop_cache = {}  # sop_id -> (time.monotonic() expiry, SOPSnapshot)
+_sop_cache_lock = threading.Lock()
+
+def get_sop(sop_id) -> Optional[SOPSnapshot]:
+    """
+    Get an SOP's prompt and structured output, cached for SOP_CACHE_TTL seconds.
+    
+    Args:
+        sop_id: ID of the SOP
+        
+    Returns:
+        Optional[SOPSnapshot]: The SOP, or None if it doesn't exist
+    """
+    now = time.monotonic()
+    with _sop_cache_lock:
+        entry = _sop_cache.get(sop_id)
+    if entry is not None and now < entry[0]:
+        return entry[1]
+    sop = SOP.query.get(sop_id)
+    if sop is None:
+        return None
+    snapshot = SOPSnapshot(
+        id=sop.id,
+        prompt=sop.prompt,
+        structured_output=sop.structured_output,
+        fingerprint=json.dumps([sop.prompt, sop.structured_output], sort_keys=True),
+    )
+    with _sop_cache_lock:
+        _sop_cache[sop_id] = (now + SOP_CACHE_TTL, snapshot)
+    return snapshot
+
+def invalidate_sop_cache(sop_id=None):
+    """Drop one cached SOP (or all of them) after it is updated or deleted"""
+    with _sop_cache_lock:
+        if sop_id is None:
+            _sop_cache.clear()
+        else:
+            _sop_cache.pop(sop_id, None)
+
+class GridBatcher:
+    """
+    Coalesces grid analyses for the same SOP into batched Gemini requests.
+    
+    Grids queued within `window` seconds of each other (up to `max_batch`) that share
+    an SOP go out as one multi-image request; each caller gets its own result back.
+    """
+    
+    def __init__(self, max_batch: int = GRID_BATCH_SIZE, window: float = GRID_BATCH_WINDOW, workers: int = ANALYSIS_WORKERS):
+        self.max_batch = max_batch
+        self.window = window
+        self._queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='gemini-batch')
+        threading.Thread(target=self._collect, daemon=True, name='grid-batcher').start()
+    
+    def submit(self, grid_path, sop: SOPSnapshot) -> Future:
+        """
+        Queue a grid for analysis; must be called inside an app context.
+        
+        Args:
+            grid_path: Path, GCS URL or encoded bytes of the grid image
+            sop: SOP to analyze the grid with
+            
+        Returns:
+            Future: Resolves to the Gemini result dict for this grid
+        """
+        future = Future()
+        self._queue.put((current_app._get_current_object(), grid_path, sop, future))
+        return future
+    
+    def _collect(self) -> None:
+        """Gather queued grids into batches and hand each SOP's share to a sender thread"""
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            groups = {}
+            for item in batch:
+                sop = item[2]
+                groups.setdefault((sop.id, sop.fingerprint), []).append(item)
+            for items in groups.values():
+                self._executor.submit(self._send, items)
+    
+    def _send(self, items: list) -> None:
+        """Analyze one SOP's grids in a single request and resolve their futures"""
+        app, _, sop, _ = items[0]
+        futures = [item[3] for item in items]
+        try:
+            with app.app_context():
+                gemini_service = GeminiService(GeminiConfig.from_app_config())
+                if len(items) == 1:
+                    results = [gemini_service.analyze_image_with_sop(items[0][1], sop)]
+                else:
+                    logger.info(f"Sending {len(items)} grids for SOP {sop.id} in one Gemini request")
+                    results = gemini_service.analyze_images_with_sop([item[1] for item in items], sop)
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+            return
+        for future, result in zip(futures, results):
+            future.set_result(result)
 
-    def __new__(cls, *args, **kwargs):
-        if cls._instance is None:
-            cls._instance = super(ScreenshotProcessor, cls).__new__(cls)
-        return cls._instance
+def load_thumbnail(image_data: bytes, size: int = 64) -> Optional[np.ndarray]:
+    """
+    Decode an encoded image as a small grayscale thumbnail for cheap frame checks.
+    
+    Args:
+        image_data: Encoded image bytes
+        size: Width and height of the thumbnail
+        
+    Returns:
+        Optional[np.ndarray]: The thumbnail, or None if the image could not be decoded
+    """
+    gray = cv2.imdecode(np.frombuffer(image_data, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    if gray is None:
+        return None
+    return cv2.resize(gray, (size, size), interpolation=cv2.INTER_AREA)
 
-    def __init__(self, gcs_utils: GCSUtils, screenshots_per_grid: int = 6, store_locally: bool = True):
+@lru_cache(maxsize=256)
+def _safe_name(name: str) -> str:
+    """Return a stream name with spaces replaced, cached per distinct name."""
+    return name.replace(' ', '_')
+
+def compute_dhash(gray: np.ndarray) -> int:
+    """
+    Compute a 64-bit difference hash of a grayscale image for near-duplicate detection.
+    
+    Args:
+        gray: Grayscale image
+        
+    Returns:
+        int: The hash
+    """
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+def compute_grid_hash(image: Image.Image, grid_rows: int, grid_cols: int) -> tuple:
+    """
+    Fingerprint a stitched grid by the dHash of each tile.
+    
+    Args:
+        image: Stitched grid image
+        grid_rows: Number of rows in the grid
+        grid_cols: Number of columns in the grid
+        
+    Returns:
+        tuple: One hash per tile, in grid order
+    """
+    gray = np.asarray(image.convert('L'))
+    return tuple(
+        compute_dhash(cell[LABEL_MARGIN:])  # Leave out the label bar, its timestamp always changes
+        for band in np.array_split(gray, grid_rows, axis=0)
+        for cell in np.array_split(band, grid_cols, axis=1)
+    )
+
+class ScreenshotProcessor:
+    def __init__(self, gcs_utils: GCSUtils, screenshots_per_grid: int = 6, store_locally: bool = False, dedup_threshold: int = 5, blank_threshold: float = 5.0, grid_interval: float = 60.0, analysis_cache_ttl: float = 600.0):
         """
-        Initialize the ScreenshotProcessor.
+        Initialize the ScreenshotProcessor. Use get_screenshot_processor() to share one per process.
         
         Args:
             gcs_utils: GCSUtils instance for GCS operations
             screenshots_per_grid: Number of screenshots needed for a grid (should be grid_rows * grid_cols)
             store_locally: Whether to store screenshots locally as well as in GCS
+            dedup_threshold: Skip frames whose dHash differs from the last kept frame by fewer bits (0 disables)
+            blank_threshold: Skip frames whose grayscale standard deviation is below this (0 disables)
+            grid_interval: Seconds between grids for each stream
+            analysis_cache_ttl: Seconds a Gemini result is reused for an unchanged grid (0 disables)
+        """
+        self.gcs_utils = gcs_utils
+        self.screenshots_per_grid = screenshots_per_grid
+        self.last_grid_at = {}  # stream_id -> time.monotonic() of the last grid (or first screenshot)
+        self.recent_urls = {}  # stream_id -> deque of the latest uploaded screenshot URLs
+        self.last_grids = {}  # stream_id -> (tile URLs, grid URL, grid hash) of the last uploaded grid
+        self._grid_lock = threading.Lock()  # Guards last_grid_at/recent_urls/last_grids across worker threads
+        self.last_hashes = {}  # stream_id -> dHash of the last kept frame
+        self.pending_analyses = []  # (Analysis row, failed flush attempts) waiting for the next batched insert
+        self._pending_lock = threading.Lock()
+        self.analysis_cache = OrderedDict()  # (stream_id, sop_id, SOP fingerprint, grid hash) -> (expiry, result), oldest first
+        self.last_results = {}  # (stream_id, sop_id) -> (grid URL, SOP fingerprint, result) of the last analysis
+        self._cache_lock = threading.Lock()  # Guards analysis_cache/last_results
+        self.grid_batcher = GridBatcher()
+        self.grid_executor = ThreadPoolExecutor(max_workers=GRID_WORKERS, thread_name_prefix='grid-builder')
+        self.configure(store_locally, dedup_threshold, blank_threshold, grid_interval, analysis_cache_ttl)
+        logger.info("Initialized new ScreenshotProcessor instance")
+    
+    def configure(self, store_locally: bool = False, dedup_threshold: int = 5, blank_threshold: float = 5.0, grid_interval: float = 60.0, analysis_cache_ttl: float = 600.0) -> None:
+        """
+        Update local storage and frame filter settings; see __init__ for the arguments.
         """
-        if not self._initialized:
-            self.gcs_utils = gcs_utils
-            self.screenshots_per_grid = screenshots_per_grid
-            self.screenshot_counts = defaultdict(int)
-            self._initialized = True
-            logger.info("Initialized new ScreenshotProcessor instance")
-        # Always update store_locally, even if already initialized
         self.store_locally = store_locally
+        self.dedup_threshold = dedup_threshold
+        self.blank_threshold = blank_threshold
+        self.grid_interval = grid_interval
+        self.analysis_cache_ttl = analysis_cache_ttl
+        if store_locally:
+            # Created once here rather than on every screenshot and grid
+            os.makedirs(LOCAL_SCREENSHOT_DIR, exist_ok=True)
+            os.makedirs(LOCAL_GRID_DIR, exist_ok=True)
     
     def create_analysis_record(self, rtsp_id: str, sop_id: str, output: dict) -> bool:
         """
-        Create an analysis record through the API.
+        Queue an analysis record to be written with the next batched insert.
         
         Args:
             rtsp_id: ID of the RTSP stream
@@ -53,125 +282,251 @@ class ScreenshotProcessor:
             output: Analysis output dict
             
         Returns:
-            bool: True if creation was successful
+            bool: True if the record was queued
         """
-        try:
-            response = requests.post(
-                get_api_url('/api/analysis'),
-                json={
-                    'rtsp_id': rtsp_id,
-                    'sop_id': sop_id,
-                    'output': output
-                }
-            )
-            if not response.ok:
-                logger.error(f"Failed to create analysis record: {response.text}")
-                return False
-            return True
-        except Exception as e:
-            logger.error(f"Error creating analysis record: {e}")
+        if not output:
+            logger.error(f"Not saving analysis for stream {rtsp_id}, SOP {sop_id}: output is empty")
             return False
+        row = Analysis(
+            rtsp_id=rtsp_id,
+            sop_id=sop_id,
+            timestamp=datetime.now(),
+            output=output
+        )
+        self._queue_analyses([(row, 0)])
+        return True
     
-    def analyze_grid_with_gemini(self, grid_path: str, rtsp_id: str, sop_id: str) -> dict:
+    def _queue_analyses(self, entries: list, front: bool = False) -> None:
+        """Add (row, attempts) entries to the pending queue, dropping the oldest past MAX_PENDING_ANALYSES."""
+        with self._pending_lock:
+            if front:
+                self.pending_analyses[:0] = entries
+            else:
+                self.pending_analyses.extend(entries)
+            overflow = len(self.pending_analyses) - MAX_PENDING_ANALYSES
+            if overflow > 0:
+                del self.pending_analyses[:overflow]
+        if overflow > 0:
+            logger.error(f"Analysis queue full, dropped the {overflow} oldest unsaved records")
+    
+    def flush_analysis_records(self) -> int:
         """
-        Analyze a grid image using Gemini service and create an analysis record.
+        Write all queued analysis records in a single transaction.
+        
+        If the batch fails, rows are retried one at a time so a single bad row (e.g. its
+        SOP or stream was deleted meanwhile) doesn't discard the rest. Rows that fail for
+        other reasons than an integrity error are queued again, up to MAX_FLUSH_ATTEMPTS.
+        
+        Returns:
+            int: Number of records written
+        """
+        with self._pending_lock:
+            entries, self.pending_analyses = self.pending_analyses, []
+        if not entries:
+            return 0
+        try:
+            db.session.bulk_save_objects([row for row, _ in entries])
+            db.session.commit()
+            logger.info(f"Saved {len(entries)} analysis records")
+            return len(entries)
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            logger.warning(f"Batch insert of {len(entries)} analysis records failed, saving them one by one: {e}")
+        
+        saved = 0
+        retry = []
+        for row, attempts in entries:
+            try:
+                db.session.add(row)
+                db.session.commit()
+                saved += 1
+            except IntegrityError as e:
+                db.session.rollback()
+                logger.error(f"Dropping analysis record for stream {row.rtsp_id}, SOP {row.sop_id}: {e}")
+            except SQLAlchemyError as e:
+                db.session.rollback()
+                if attempts + 1 >= MAX_FLUSH_ATTEMPTS:
+                    logger.error(f"Dropping analysis record for stream {row.rtsp_id}, SOP {row.sop_id} after {MAX_FLUSH_ATTEMPTS} failed saves: {e}")
+                else:
+                    logger.error(f"Failed to save analysis record for stream {row.rtsp_id}, SOP {row.sop_id}, will retry: {e}")
+                    retry.append((row, attempts + 1))
+        if retry:
+            self._queue_analyses(retry, front=True)
+        logger.info(f"Saved {saved} of {len(entries)} analysis records")
+        return saved
+    
+    def _get_cached_analysis(self, key: tuple) -> Optional[dict]:
+        """Return a cached Gemini result that hasn't expired, or None."""
+        with self._cache_lock:
+            entry = self.analysis_cache.get(key)
+            if entry is None:
+                return None
+            expires_at, result = entry
+            if time.monotonic() >= expires_at:
+                del self.analysis_cache[key]
+                return None
+            return result
+    
+    def _cache_analysis(self, key: tuple, result: dict) -> None:
+        """Remember a Gemini result, evicting the oldest entries past ANALYSIS_CACHE_SIZE."""
+        with self._cache_lock:
+            self.analysis_cache[key] = (time.monotonic() + self.analysis_cache_ttl, result)
+            self.analysis_cache.move_to_end(key)
+            while len(self.analysis_cache) > ANALYSIS_CACHE_SIZE:
+                self.analysis_cache.popitem(last=False)
+    
+    def analyze_grid_with_gemini(self, grid_path: str, rtsp_id: str, sop_id: str, grid_hash: tuple = None, grid_bytes: bytes = None) -> Future:
+        """
+        Queue a grid image for Gemini analysis; the analysis record is queued once the result arrives.
+        
+        Nothing blocks on the Gemini call: the result is cached and recorded from a done
+        callback on the batcher's sender thread, so grids only wait in the batcher queue.
         
         Args:
-            grid_path: Path to the grid image file
+            grid_path: Path or GCS URL of the grid image; the last result for the same grid and SOP version is reused
             rtsp_id: ID of the RTSP stream
             sop_id: ID of the SOP
+            grid_hash: Fingerprint from compute_grid_hash; an unexpired result for the same stream, SOP version and hash is reused
+            grid_bytes: Encoded grid image; when given it is sent as-is and grid_path is only used for logging
             
         Returns:
-            dict: Analysis results from Gemini service
+            Future: Resolves to the analysis results from Gemini service
             
         Raises:
-            Exception: If analysis fails
+            ValueError: If the SOP or its structured_output doesn't exist
         """
-        try:
-            print(f"\n{'='*50}")  # Visual separator
-            print(f"Starting Gemini analysis for grid: {grid_path}")
-            print(f"{'='*50}\n")
-            
-            logger.info(f"Starting Gemini analysis for grid: {grid_path}")
-            
-            # Fetch SOP instance from DB
-            sop = SOP.query.get(sop_id)
-            if not sop or not sop.structured_output:
-                raise ValueError("SOP or its structured_output not found")
-            
-            # Use the new GeminiService
-            gemini_service = GeminiService(GeminiConfig.from_app_config())
-            result = gemini_service.analyze_image_with_sop(grid_path, sop)
-            
-            print(f"\n{'='*50}")
-            print(f"Gemini analysis result: {result}")
-            print(f"{'='*50}\n")
-            
+        # Fetch SOP from the cache, or the DB if it's stale
+        sop = get_sop(sop_id)
+        if not sop or not sop.structured_output:
+            raise ValueError("SOP or its structured_output not found")
+        
+        # Editing the SOP changes its fingerprint, so old results stop matching; results
+        # are per stream so two cameras with look-alike grids (e.g. both dark) don't share one
+        cache_key = (rtsp_id, sop_id, sop.fingerprint, grid_hash) if grid_hash is not None and self.analysis_cache_ttl > 0 else None
+        
+        # The same grid object (reused because its tiles didn't change) keeps its result indefinitely
+        with self._cache_lock:
+            last = self.last_results.get((rtsp_id, sop_id))
+        result = last[2] if last is not None and last[:2] == (grid_path, sop.fingerprint) else None
+        if result is None and cache_key:
+            result = self._get_cached_analysis(cache_key)
+        
+        if result is not None:
+            logger.info(f"Reusing cached Gemini analysis for unchanged grid: {grid_path}")
+            self._record_analysis(grid_path, rtsp_id, sop, result)
+            future = Future()
+            future.set_result(result)
+            return future
+        
+        logger.info(f"Starting Gemini analysis for grid: {grid_path}")
+        
+        def on_done(done: Future) -> None:
+            try:
+                result = done.result()
+            except Exception as e:
+                logger.error(f"Gemini analysis failed for grid {grid_path}: {e}")
+                return
             logger.info(f"Gemini analysis result: {result}")
-            
-            # Create analysis record through API (send as JSON, not string)
-            if not self.create_analysis_record(rtsp_id, sop_id, result):
-                logger.error("Failed to create analysis record")
-            
-            return result
-        except Exception as e:
-            print(f"\n{'='*50}")
-            print(f"ERROR: Gemini analysis failed for grid {grid_path}: {e}")
-            print(f"{'='*50}\n")
-            
-            logger.error(f"Gemini analysis failed for grid {grid_path}: {e}")
-            raise
+            if cache_key:
+                self._cache_analysis(cache_key, result)
+            self._record_analysis(grid_path, rtsp_id, sop, result)
+        
+        # Batched with other streams' grids for this SOP when they arrive together
+        future = self.grid_batcher.submit(grid_bytes if grid_bytes is not None else grid_path, sop)
+        future.add_done_callback(on_done)
+        return future
+    
+    def _record_analysis(self, grid_path: str, rtsp_id: str, sop: SOPSnapshot, result: dict) -> None:
+        """Remember a grid's result for reuse and queue its analysis record for the next batched insert."""
+        with self._cache_lock:
+            self.last_results[(rtsp_id, sop.id)] = (grid_path, sop.fingerprint, result)
+        if not self.create_analysis_record(rtsp_id, sop.id, result):
+            logger.error("Failed to create analysis record")
     
-    def process_screenshot(self, stream_id: str, stream_name: str, frame_path: str, grid_rows: int = 2, grid_cols: int = 3) -> bool:
+    def _run_grid(self, app, stream_id: str, stream_name: str, grid_rows: int, grid_cols: int, screenshot_urls: list = None) -> None:
         """
-        Process a single screenshot: save locally, upload to GCS, and create grid if needed.
+        Build, upload and queue analysis for a grid on a background worker thread.
         
         Args:
+            app: Flask application used to push an app context
             stream_id: ID of the stream
             stream_name: Name of the stream
-            frame_path: Path to the frame image
+            grid_rows: Number of rows in the grid
+            grid_cols: Number of columns in the grid
+            screenshot_urls: URLs of the screenshots to stitch, oldest first
+        """
+        with app.app_context():
+            if not self._create_grid(stream_id, stream_name, grid_rows, grid_cols, screenshot_urls):
+                logger.error(f"Failed to create grid for stream {stream_name}")
+    
+    def process_screenshot(self, stream_id: str, stream_name: str, frame_bytes: bytes, grid_rows: int = 2, grid_cols: int = 3) -> bool:
+        """
+        Process a single screenshot: save locally, upload to GCS, and queue a grid if needed.
+        
+        Args:
+            stream_id: ID of the stream
+            stream_name: Name of the stream
+            frame_bytes: JPEG-encoded frame
             grid_rows: Number of rows in the grid (default 2)
             grid_cols: Number of columns in the grid (default 3)
             
         Returns:
             bool: True if processing was successful
         """
-        if not os.path.exists(frame_path):
-            logger.error(f"Frame path does not exist: {frame_path}")
-            return False
-            
         try:
+            # Truncated frames are common while the RTSP source reconnects
+            if len(frame_bytes) < MIN_FRAME_BYTES:
+                logger.warning(f"Skipping truncated frame for {stream_name} ({len(frame_bytes)} bytes)")
+                return True
+            
             # Validate grid dimensions
             if grid_rows * grid_cols != self.screenshots_per_grid:
                 logger.warning(f"Grid dimensions ({grid_rows}x{grid_cols}) don't match screenshots_per_grid ({self.screenshots_per_grid})")
                 self.screenshots_per_grid = grid_rows * grid_cols
             
-            # Format current time
-            current_time = datetime.now().strftime('%y-%m-%d--%H--%M--%S')
-            file_name = f"screenshots/{stream_id}-{stream_name.replace(' ', '_')}-{current_time}.jpg"
+            thumbnail = None
+            frame_hash = None
+            if self.blank_threshold > 0 or self.dedup_threshold > 0:
+                thumbnail = load_thumbnail(frame_bytes)
+            
+            if thumbnail is not None:
+                # Skip black/blank frames, e.g. while the camera is reconnecting
+                if self.blank_threshold > 0 and thumbnail.std() < self.blank_threshold:
+                    logger.warning(f"Skipping blank frame for {stream_name}")
+                    return True
+                
+                # Skip frames that are near-identical to the last kept frame for this stream
+                if self.dedup_threshold > 0:
+                    frame_hash = compute_dhash(thumbnail)
+                    last_hash = self.last_hashes.get(stream_id)
+                    if last_hash is not None and (frame_hash ^ last_hash).bit_count() < self.dedup_threshold:
+                        logger.info(f"Skipping near-duplicate frame for {stream_name}")
+                        # An idle camera still gets its periodic grid; the unchanged tiles hit the analysis cache
+                        self._queue_grid_if_due(stream_id, stream_name, grid_rows, grid_cols)
+                        return True
+            
+            # Reverse key first so listing the stream's prefix returns the newest shots first
+            captured_at = time.time()
+            current_time = time.strftime('%y-%m-%d--%H--%M--%S', time.localtime(captured_at))
+            file_name = f"{screenshot_prefix(stream_id)}{reverse_timestamp_key(captured_at)}-{_safe_name(stream_name)}-{current_time}.jpg"
             
             # Upload to GCS
-            if not self.gcs_utils.upload_file(frame_path, file_name):
+            if not self.gcs_utils.upload_bytes(frame_bytes, file_name):
                 logger.error(f"Failed to upload screenshot to GCS: {file_name}")
                 return False
             
+            # Only a stored frame counts as the one later frames are deduplicated against
+            if frame_hash is not None:
+                self.last_hashes[stream_id] = frame_hash
+            
             # Save locally if enabled
             if self.store_locally:
-                local_dir = os.path.join('uploads', 'screenshots')
-                os.makedirs(local_dir, exist_ok=True)
-                local_path = os.path.join(local_dir, os.path.basename(file_name))
-                shutil.copy2(frame_path, local_path)
-            
-            # Increment counter and check if we need to create a grid
-            self.screenshot_counts[stream_id] += 1
+                local_path = os.path.join(LOCAL_SCREENSHOT_DIR, os.path.basename(file_name))
+                with open(local_path, 'wb') as local_file:
+                    local_file.write(frame_bytes)
             
-            if self.screenshot_counts[stream_id] >= self.screenshots_per_grid:
-                # Reset counter before attempting grid creation
-                self.screenshot_counts[stream_id] = 0
-                success = self._create_grid(stream_id, stream_name, grid_rows, grid_cols)
-                if not success:
-                    logger.error(f"Failed to create grid for stream {stream_name}")
-                    return False
+            # Remember the upload and queue a grid if this stream's interval has elapsed
+            self._queue_grid_if_due(stream_id, stream_name, grid_rows, grid_cols, self.gcs_utils.get_file_url(file_name))
             
             return True
             
@@ -179,7 +534,85 @@ class ScreenshotProcessor:
             logger.exception(f"Failed to process screenshot for {stream_name}: {e}")
             return False
     
-    def _create_grid(self, stream_id: str, stream_name: str, grid_rows: int, grid_cols: int) -> bool:
+    def _queue_grid_if_due(self, stream_id: str, stream_name: str, grid_rows: int, grid_cols: int, screenshot_url: str = None) -> None:
+        """
+        Record a new screenshot URL and queue a grid once the stream's grid interval has elapsed.
+        
+        Args:
+            stream_id: ID of the stream
+            stream_name: Name of the stream
+            grid_rows: Number of rows in the grid
+            grid_cols: Number of columns in the grid
+            screenshot_url: URL of the screenshot just uploaded, or None if the frame was skipped as a duplicate
+        """
+        now = time.monotonic()
+        with self._grid_lock:
+            recent = self.recent_urls.get(stream_id)
+            if recent is None or recent.maxlen != self.screenshots_per_grid:
+                recent = self.recent_urls[stream_id] = deque(recent or (), maxlen=self.screenshots_per_grid)
+            if screenshot_url:
+                recent.append(screenshot_url)
+            last_grid_at = self.last_grid_at.setdefault(stream_id, now)
+            if now - last_grid_at < self.grid_interval:
+                return
+            self.last_grid_at[stream_id] = now
+            grid_urls = list(recent)
+        
+        # Build the grid in the next pipeline stage so capture can continue
+        app = current_app._get_current_object()
+        self.grid_executor.submit(self._run_grid, app, stream_id, stream_name, grid_rows, grid_cols, grid_urls)
+    
+    def _build_grid(self, stream_id: str, grid_rows: int, grid_cols: int, recent_screenshot_urls: list) -> Optional[tuple]:
+        """
+        Stitch screenshots into a grid and upload it to GCS.
+        
+        Args:
+            stream_id: ID of the stream
+            grid_rows: Number of rows in the grid
+            grid_cols: Number of columns in the grid
+            recent_screenshot_urls: URLs of the screenshots to stitch, oldest first
+            
+        Returns:
+            Optional[tuple]: (grid URL, grid hash, encoded grid bytes), or None if the upload failed
+        """
+        # Use the filename of the first screenshot for the grid filename
+        first_url = recent_screenshot_urls[0]
+        first_filename = os.path.basename(urlparse(first_url).path)
+        grid_filename = f"grids/{stream_id}/{first_filename.rsplit('.', 1)[0]}.jpg"
+        grid_path = os.path.join(LOCAL_GRID_DIR, os.path.basename(grid_filename))
+        
+        # Process the images into a grid
+        stitched = process_images(
+            recent_screenshot_urls, grid_path, grid_rows, grid_cols,
+            store_locally=False,
+            fetch=self.gcs_utils.download_url  # Authenticated client instead of public HTTPS per tile
+        )
+        
+        grid_hash = compute_grid_hash(stitched, grid_rows, grid_cols) if self.analysis_cache_ttl > 0 else None
+        
+        # Encode once; the upload, the local copy and Gemini all use these bytes
+        grid_bytes = encode_grid(stitched)
+        
+        # Upload grid to GCS
+        if not self.gcs_utils.upload_bytes(grid_bytes, grid_filename):
+            logger.error(f"Failed to upload grid to GCS: {grid_filename}")
+            return None
+        
+        # Save locally if enabled
+        if self.store_locally:
+            with open(grid_path, 'wb') as grid_file:
+                grid_file.write(grid_bytes)
+            logger.info(f"Saved stitched image: {grid_path}")
+        
+        # Get GCS URL for the grid
+        grid_url = self.gcs_utils.get_file_url(grid_filename)
+        if not grid_url:
+            logger.error(f"Failed to get GCS URL for grid: {grid_filename}")
+            return None
+        
+        return grid_url, grid_hash, grid_bytes
+    
+    def _create_grid(self, stream_id: str, stream_name: str, grid_rows: int, grid_cols: int, screenshot_urls: list = None) -> bool:
         """
         Create a grid image from recent screenshots and analyze it with Gemini.
         
@@ -188,59 +621,42 @@ class ScreenshotProcessor:
             stream_name: Name of the stream
             grid_rows: Number of rows in the grid
             grid_cols: Number of columns in the grid
+            screenshot_urls: URLs of the screenshots to stitch, oldest first (listed from GCS if not enough)
             
         Returns:
             bool: True if grid creation and analysis were successful
         """
         try:
-            # Get recent screenshot URLs
-            recent_screenshot_urls = self.gcs_utils.get_recent_screenshot_urls(
-                stream_id, 
-                self.screenshots_per_grid
-            )
+            # Use the uploads tracked in memory; only list GCS if they don't fill a grid
+            recent_screenshot_urls = screenshot_urls or []
+            if len(recent_screenshot_urls) != self.screenshots_per_grid:
+                recent_screenshot_urls = self.gcs_utils.get_recent_screenshot_urls(
+                    stream_id, 
+                    self.screenshots_per_grid
+                )
             
             if len(recent_screenshot_urls) != self.screenshots_per_grid:
                 logger.warning(f"Not enough screenshots for grid creation: {stream_name}. Got {len(recent_screenshot_urls)}, need {self.screenshots_per_grid}")
                 return False
             
-            # Use the filename of the first screenshot for the grid filename
-            first_url = recent_screenshot_urls[0]
-            first_filename = os.path.basename(urlparse(first_url).path)
-            grid_filename = f"grids/{first_filename.rsplit('.', 1)[0]}.png"
-            grid_path = os.path.join('uploads', grid_filename)
-            
-            # Ensure grids directory exists
-            os.makedirs(os.path.dirname(grid_path), exist_ok=True)
-            
-            # Process the images into a grid
-            stitched = process_images(recent_screenshot_urls, grid_path, grid_rows, grid_cols, store_locally=self.store_locally)
-            
-            if self.store_locally:
-                upload_path = grid_path
+            # Idle cameras keep the same tiles; reuse that grid instead of re-stitching and re-uploading it
+            tiles = tuple(recent_screenshot_urls)
+            with self._grid_lock:
+                last_grid = self.last_grids.get(stream_id)
+            if last_grid is not None and last_grid[0] == tiles:
+                logger.info(f"Tiles unchanged since the last grid for {stream_name}, reusing {last_grid[1]}")
+                grid_url, grid_hash, grid_bytes = last_grid[1], last_grid[2], None
             else:
-                # Save to a temp file for upload
-                with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as tmp:
-                    stitched.save(tmp.name)
-                    upload_path = tmp.name
-            
-            # Upload grid to GCS
-            if not self.gcs_utils.upload_file(upload_path, grid_filename):
-                logger.error(f"Failed to upload grid to GCS: {grid_filename}")
-                return False
-            
-            # Clean up temp file if needed
-            if not self.store_locally:
-                os.remove(upload_path)
-            
-            # Get GCS URL for the grid
-            grid_url = self.gcs_utils.get_file_url(grid_filename)
-            if not grid_url:
-                logger.error(f"Failed to get GCS URL for grid: {grid_filename}")
-                return False
+                built = self._build_grid(stream_id, grid_rows, grid_cols, recent_screenshot_urls)
+                if built is None:
+                    return False
+                grid_url, grid_hash, grid_bytes = built
+                with self._grid_lock:
+                    self.last_grids[stream_id] = (tiles, grid_url, grid_hash)
             
             # Get SOPs for this stream
             try:
-                response = requests.get(get_api_url(f'/api/stream/{stream_id}'))
+                response = _SESSION.get(get_api_url(f'/api/stream/{stream_id}'), timeout=API_TIMEOUT)
                 if not response.ok:
                     logger.error(f"Failed to get stream details: {response.text}")
                     return False
@@ -250,15 +666,12 @@ class ScreenshotProcessor:
                     logger.warning(f"No SOPs associated with stream {stream_name}")
                     return True
                 
-                # Analyze the grid with each SOP
+                # Queue the grid for analysis with each SOP; results are recorded as they arrive
                 for sop in stream_data['sops']:
                     try:
-                        analysis_result = self.analyze_grid_with_gemini(grid_url, stream_id, sop['id'])
-                        logger.info(f"Successfully analyzed grid with SOP {sop['name']} (ID: {sop['id']})")
+                        self.analyze_grid_with_gemini(grid_url, stream_id, sop['id'], grid_hash=grid_hash, grid_bytes=grid_bytes)
                     except Exception as e:
                         logger.error(f"Grid analysis failed for SOP {sop['name']} (ID: {sop['id']}): {e}")
-                        # Continue with other SOPs even if one fails
-                        continue
                     
             except Exception as e:
                 logger.error(f"Error getting stream details: {e}")
@@ -268,3 +681,27 @@ class ScreenshotProcessor:
         except Exception as e:
             logger.exception(f"Grid creation failed for {stream_name}: {e}")
             return False
+
+_processor = None
+_processor_lock = threading.Lock()
+
+def get_screenshot_processor(gcs_utils: GCSUtils, screenshots_per_grid: int = 6, **settings) -> ScreenshotProcessor:
+    """
+    Get the process-wide ScreenshotProcessor, creating it on first use.
+    
+    Args:
+        gcs_utils: GCSUtils instance, used only when the processor is created
+        screenshots_per_grid: Number of screenshots in a grid, used only when the processor is created
+        **settings: ScreenshotProcessor.configure() arguments, applied on every call
+        
+    Returns:
+        ScreenshotProcessor: The shared instance
+    """
+    global _processor
+    if _processor is None:
+        with _processor_lock:
+            if _processor is None:
+                _processor = ScreenshotProcessor(gcs_utils, screenshots_per_grid, **settings)
+                return _processor
+    _processor.configure(**settings)
+    return _processor
@@ -1,4 +1,5 @@
 import logging
+import selectors
 import subprocess
 import os
 import signal
@@ -26,28 +27,88 @@ class StreamManager:
     TIMEOUT_USEC = 5_000_000         # socket I/O timeout in microseconds
     LOG_HISTORY_SIZE = 100           # number of stderr lines to keep
     VERIFY_TIMEOUT = 10              # seconds to wait for HLS readiness
+    VERIFY_POLL_INTERVAL = 0.1       # seconds between HLS readiness checks
+    HLS_AUDIO = False                # re-encode camera audio to AAC into the HLS output; CCTV is viewed muted
+    FRAME_INTERVAL = 2               # seconds between rewrites of the latest-frame JPEG
+    FRAME_MAX_AGE = 15               # seconds before the latest frame counts as stale
+    LATEST_FRAME = 'latest.jpg'      # file kept up to date by ffmpeg in each temp dir
+    FRAME_KEYFRAMES_ONLY = False     # decode only keyframes for latest.jpg; off because CCTV GOPs can run 10-60 s
 
-    def __init__(self) -> None:
+    def __init__(self, frame_max_dim: Optional[int] = None) -> None:
         self._lock = threading.Lock()
+        self.frame_max_dim = frame_max_dim               # longest side of the latest frame; None keeps full size
         self.streams: Dict[str, str] = {}                # stream_id -> rtsp_url
         self.temp_dirs: Dict[str, str] = {}              # stream_id -> temp directory
         self.processes: Dict[str, subprocess.Popen] = {} # stream_id -> process
         self.status: Dict[str, Dict[str, Any]] = {}      # stream_id -> {status, error}
         self.ffmpeg_logs: Dict[str, deque] = {}          # stream_id -> recent stderr lines
+        self._log_selector = selectors.DefaultSelector()  # stderr pipes drained by the log thread
+        self._log_partial: Dict[int, bytes] = {}         # stderr fd -> trailing bytes of an unfinished line; log thread only
+        self._log_thread: Optional[threading.Thread] = None
         atexit.register(self.stop_all)
 
     def _log_ffmpeg(self, process: subprocess.Popen, stream_id: str) -> None:
-        def reader():
-            while True:
-                line = process.stderr.readline()
-                if not line:
-                    break
-                text = line.strip()
-                with self._lock:
-                    dq = self.ffmpeg_logs.setdefault(stream_id, deque(maxlen=self.LOG_HISTORY_SIZE))
-                    dq.append(text)
-        t = threading.Thread(target=reader, daemon=True)
-        t.start()
+        if os.name == 'nt':
+            # select() only handles sockets on Windows, so keep a reader thread per stream there
+            def reader():
+                while True:
+                    line = process.stderr.readline()
+                    if not line:
+                        break
+                    self._append_logs(process, stream_id, [line.strip()])
+            threading.Thread(target=reader, daemon=True).start()
+            return
+        # One thread multiplexes every stream's stderr instead of a reader thread per stream
+        os.set_blocking(process.stderr.fileno(), False)
+        with self._lock:
+            self._log_selector.register(process.stderr, selectors.EVENT_READ, data=(stream_id, process))
+            if self._log_thread is None:
+                self._log_thread = threading.Thread(target=self._drain_logs, daemon=True, name='ffmpeg-logs')
+                self._log_thread.start()
+
+    def _append_logs(self, process: subprocess.Popen, stream_id: str, lines: list) -> None:
+        with self._lock:
+            # Drop output from a process that has since been stopped or replaced
+            if self.processes.get(stream_id) is not process:
+                return
+            dq = self.ffmpeg_logs.setdefault(stream_id, deque(maxlen=self.LOG_HISTORY_SIZE))
+            dq.extend(lines)
+
+    def _close_log(self, process: subprocess.Popen) -> None:
+        # Only called from the log thread, so it can't race a read on the same fd
+        if os.name == 'nt' or process.stderr is None:
+            return
+        try:
+            fd = process.stderr.fileno()
+            self._log_selector.unregister(process.stderr)
+        except (KeyError, ValueError):
+            return  # Already closed
+        self._log_partial.pop(fd, None)
+        process.stderr.close()
+
+    def _drain_logs(self) -> None:
+        while True:
+            if not self._log_selector.get_map():
+                time.sleep(1.0)
+                continue
+            for key, _ in self._log_selector.select(timeout=1.0):
+                stream_id, process = key.data
+                try:
+                    chunk = os.read(key.fd, 4096)
+                except BlockingIOError:
+                    continue
+                except OSError:
+                    chunk = b''
+                if not chunk:
+                    # EOF: ffmpeg exited
+                    self._close_log(process)
+                    continue
+                # ffmpeg ends progress lines with \r; treat it like \n as text mode did
+                data = self._log_partial.pop(key.fd, b'') + chunk.replace(b'\r', b'\n')
+                *lines, self._log_partial[key.fd] = data.split(b'\n')
+                lines = [line.decode(errors='replace').strip() for line in lines if line.strip()]
+                if lines:
+                    self._append_logs(process, stream_id, lines)
 
     def _launch_ffmpeg(self, stream_id: str, rtsp_url: str, output_dir: str) -> None:
         playlist = os.path.join(output_dir, 'playlist.m3u8')
@@ -57,12 +118,13 @@ class StreamManager:
             '-analyzeduration', str(self.ANALYZE_DURATION),
             '-rtsp_transport', 'tcp',
             '-timeout', str(self.TIMEOUT_USEC),
+            # Keyframe-only decoding is cheaper, but a frame can then be a whole GOP old
+            *(['-skip_frame', 'nokey'] if self.FRAME_KEYFRAMES_ONLY else []),
             '-i', rtsp_url,
             '-c:v', 'copy',
             '-bsf:v', 'hevc_mp4toannexb',
             '-tag:v', 'hvc1',
-            '-c:a', 'aac',
-            '-b:a', '128k',
+            *(['-c:a', 'aac', '-b:a', '128k'] if self.HLS_AUDIO else ['-an']),
             '-f', 'hls',
             '-hls_time', str(self.HLS_SEGMENT_TIME),
             '-hls_list_size', str(self.HLS_LIST_SIZE),
@@ -76,6 +138,25 @@ class StreamManager:
             '-y',
             playlist
         ]
+        # Second output: the same process keeps one JPEG of the newest frame up to date,
+        # so screenshots don't need an ffmpeg run per frame
+        frame_filter = f"fps=1/{self.FRAME_INTERVAL}"
+        if self.frame_max_dim:
+            # Shrink the longest side to frame_max_dim (never upscale) before JPEG encoding
+            frame_filter += (f",scale='min({self.frame_max_dim},iw)':'min({self.frame_max_dim},ih)'"
+                             ":force_original_aspect_ratio=decrease")
+        cmd += [
+            '-map', '0:v:0',
+            '-an',
+            '-vf', frame_filter,
+            '-c:v', 'mjpeg',
+            '-q:v', '2',
+            '-f', 'image2',
+            '-update', '1',
+            '-atomic_writing', '1',
+            '-y',
+            os.path.join(output_dir, self.LATEST_FRAME)
+        ]
         creationflags = 0
         if os.name == 'nt':
             creationflags = subprocess.CREATE_NEW_PROCESS_GROUP
@@ -95,23 +176,19 @@ class StreamManager:
 
     def _verify_hls(self, stream_id: str, output_dir: str, timeout: int) -> bool:
         playlist = os.path.join(output_dir, 'playlist.m3u8')
-        end = time.time() + timeout
-        while time.time() < end:
-            if not os.path.exists(playlist):
-                time.sleep(0.5)
-                continue
+        end = time.monotonic() + timeout
+        while time.monotonic() < end:
             try:
-                files = os.listdir(output_dir)
-                ts = [f for f in files if f.endswith('.ts')]
-                if not ts:
-                    time.sleep(0.5)
-                    continue
                 with open(playlist, 'r') as f:
-                    data = f.read()
-                if data.startswith('#EXTM3U'):
-                    return True
-            except Exception:
-                time.sleep(0.5)
+                    ready = f.read(7) == '#EXTM3U'
+                if ready:
+                    # scandir stops at the first segment instead of listing the whole directory
+                    with os.scandir(output_dir) as entries:
+                        if any(entry.name.endswith('.ts') for entry in entries):
+                            return True
+            except OSError:
+                pass  # Playlist not written yet
+            time.sleep(self.VERIFY_POLL_INTERVAL)
         return False
 
     def start_stream(self, stream_id: str, rtsp_url: str) -> bool:
@@ -151,21 +228,18 @@ class StreamManager:
             self.stop_stream(stream_id)
         return stat
 
-    def get_latest_frame(self, stream_id: str) -> Optional[str]:
+    def get_latest_frame(self, stream_id: str) -> Optional[bytes]:
         with self._lock:
             d = self.temp_dirs.get(stream_id)
-        if not d or not os.path.isdir(d):
-            return None
-        ts = [f for f in os.listdir(d) if f.endswith('.ts')]
-        if not ts:
+        if not d:
             return None
-        seg = os.path.join(d, sorted(ts)[-1])
-        out = os.path.join(d, f"{stream_id}_latest.jpg")
-        cmd = ['ffmpeg', '-i', seg, '-frames:v', '1', '-q:v', '2', out, '-y']
         try:
-            subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
-            return out
-        except subprocess.CalledProcessError:
+            with open(os.path.join(d, self.LATEST_FRAME), 'rb') as f:
+                # ffmpeg stopped updating it, e.g. the camera dropped
+                if time.time() - os.fstat(f.fileno()).st_mtime > self.FRAME_MAX_AGE:
+                    return None
+                return f.read() or None
+        except OSError:
             return None
 
     def stop_stream(self, stream_id: str) -> None:
@@ -184,6 +258,8 @@ class StreamManager:
                 proc.wait(5)
             except Exception:
                 proc.kill()
+            # Killing ffmpeg ends its stderr; the log thread closes the pipe on that EOF.
+            # Closing it here could free the fd while the log thread is still reading it.
         if temp and os.path.isdir(temp):
             shutil.rmtree(temp, ignore_errors=True)
 
@@ -1,6 +1,12 @@
+from functools import lru_cache
 from flask import current_app
 
+@lru_cache(maxsize=128)
+def _build_api_url(base_url, endpoint):
+    """Join a base URL and endpoint, cached per distinct pair"""
+    return f"{base_url.rstrip('/')}/{endpoint.lstrip('/')}"
+
 def get_api_url(endpoint):
     """Get the full API URL for an endpoint"""
     base_url = current_app.config.get('API_BASE_URL', 'http://localhost:8000')
-    return f"{base_url.rstrip('/')}/{endpoint.lstrip('/')}" 
\ No newline at end of file
+    return _build_api_url(base_url, endpoint)
@@ -1,15 +1,77 @@
 import logging
 import os
-from typing import List
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional
+from urllib.parse import quote, unquote, urlparse
 from dotenv import load_dotenv
+from google.auth.transport.requests import AuthorizedSession
 from google.cloud import storage
-from datetime import datetime
+from google.cloud.storage import transfer_manager
+from google.cloud.storage.retry import DEFAULT_RETRY
+from google.oauth2 import service_account
+from requests.adapters import HTTPAdapter
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+_instance = None
+_instance_lock = threading.Lock()
+
+REVERSE_KEY_BASE = 10 ** 13  # Millisecond epoch ceiling (year 2286); keeps reverse keys 13 digits wide
+
+def reverse_timestamp_key(timestamp: Optional[float] = None) -> str:
+    """
+    Get a fixed-width key that sorts newer timestamps first in lexicographic order.
+    
+    Args:
+        timestamp: Epoch seconds, defaults to now
+        
+    Returns:
+        str: Zero-padded reverse millisecond key
+    """
+    if timestamp is None:
+        timestamp = time.time()
+    return f"{REVERSE_KEY_BASE - int(timestamp * 1000):013d}"
+
+def strip_reverse_key(name: str) -> str:
+    """
+    Remove a leading reverse_timestamp_key() and its separator from a file name.
+    
+    Args:
+        name: File name, with or without the key
+        
+    Returns:
+        str: The name without the key
+    """
+    key, sep, rest = name.partition('-')
+    if sep and len(key) == 13 and key.isdigit():
+        return rest
+    return name
+
+def screenshot_prefix(stream_id) -> str:
+    """Get the GCS prefix under which a stream's screenshots are stored."""
+    return f"screenshots/{stream_id}/"
+
 class GCSUtils:
+    MAX_CONCURRENT_UPLOADS = 8  # Caps in-flight uploads against GCS quota
+    HTTP_POOL_SIZE = 64         # Keep-alive connections shared by all uploads/listings
+    UPLOAD_TIMEOUT = (2, 10)    # (connect, read) seconds per upload request
+    DOWNLOAD_TIMEOUT = (2, 5)   # (connect, read) seconds per download; grid tiles are small JPEGs
+    PARALLEL_UPLOAD_THRESHOLD = int(os.getenv('GCS_PARALLEL_UPLOAD_THRESHOLD', 16 * 1024 * 1024))  # Files above this size upload in parallel chunks
+    PARALLEL_CHUNK_SIZE = int(os.getenv('GCS_PARALLEL_CHUNK_SIZE', 16 * 1024 * 1024))  # Bytes per chunk for parallel uploads
+    PARALLEL_UPLOAD_WORKERS = int(os.getenv('GCS_PARALLEL_UPLOAD_WORKERS', 8))  # Concurrent chunk uploads per file
+    RESUMABLE_THRESHOLD = 8 * 1024 * 1024   # Files at or below this size go up in a single request anyway
+    CACHE_CONTROL = 'public, max-age=31536000, immutable'  # Uploaded names are timestamped and never rewritten
+    BATCH_SIZE = 100            # Sub-requests per batch call; GCS rejects batches over 100 calls
+    UPLOAD_ATTEMPTS = 3         # Tries per background upload before giving up
+    RESUMABLE_CHUNK_SIZE = 15 * 1024 * 1024  # Past the 10-15 MiB knee where per-chunk round trips stop dominating; multiple of 256 KiB
+    
+    # Background uploads; sized to the upload slots so queued work waits here, not on the semaphore
+    _upload_pool = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_UPLOADS, thread_name_prefix='gcs-upload')
+
     def __init__(self):
         credentials_path = os.getenv('GCS_CREDENTIALS_PATH')
         bucket_name = os.getenv('GCS_BUCKET_NAME')
@@ -17,8 +79,71 @@ class GCSUtils:
         if not credentials_path or not bucket_name:
             raise ValueError("GCS credentials path and bucket name must be set in environment variables")
         
-        self.storage_client = storage.Client.from_service_account_json(credentials_path)
-        self.bucket = self.storage_client.get_bucket(bucket_name)
+        self.credentials_path = credentials_path
+        self.bucket_name = bucket_name
+        self._storage_client = None
+        self._bucket = None
+        self._connect_lock = threading.Lock()
+        self._upload_slots = threading.BoundedSemaphore(self.MAX_CONCURRENT_UPLOADS)
+    
+    @classmethod
+    def get(cls) -> 'GCSUtils':
+        """
+        Get the process-wide GCSUtils instance, creating it on first call.
+        
+        Returns:
+            GCSUtils: Shared instance holding the pooled client and bucket handle
+        """
+        global _instance
+        if _instance is None:
+            with _instance_lock:
+                if _instance is None:
+                    _instance = cls()
+        return _instance
+    
+    def _connect(self) -> None:
+        """Create the storage client and bucket handle on first use."""
+        with self._connect_lock:
+            if self._bucket is not None:
+                return
+            credentials = service_account.Credentials.from_service_account_file(
+                self.credentials_path, scopes=storage.Client.SCOPE
+            )
+            # Pooled keep-alive transport so uploads don't pay a TLS handshake each time
+            session = AuthorizedSession(credentials)
+            adapter = HTTPAdapter(pool_connections=self.HTTP_POOL_SIZE, pool_maxsize=self.HTTP_POOL_SIZE)
+            session.mount('https://', adapter)
+            storage_client = storage.Client(
+                project=credentials.project_id,
+                credentials=credentials,
+                _http=session
+            )
+            # bucket() builds the handle locally; get_bucket() would cost a metadata RPC
+            self._bucket = storage_client.bucket(self.bucket_name)
+            self._storage_client = storage_client
+    
+    @property
+    def storage_client(self) -> storage.Client:
+        """Lazily created GCS client."""
+        if self._storage_client is None:
+            self._connect()
+        return self._storage_client
+    
+    @property
+    def bucket(self) -> storage.Bucket:
+        """Lazily fetched bucket handle."""
+        if self._bucket is None:
+            self._connect()
+        return self._bucket
+    
+    def warm_up(self) -> None:
+        """Fetch an auth token and open a pooled HTTPS connection ahead of the first real request."""
+        try:
+            # exists() is a single fields=name GET on the bucket
+            self.bucket.exists(timeout=self.UPLOAD_TIMEOUT)
+            logger.info(f"GCS connection to {self.bucket_name} warmed up")
+        except Exception as e:
+            logger.warning(f"GCS warm-up failed: {e}")
     
     def upload_file(self, file_path: str, destination_blob_name: str) -> bool:
         """
@@ -32,13 +157,117 @@ class GCSUtils:
             bool: True if upload was successful
         """
         try:
+            file_size = os.path.getsize(file_path)
             blob = self.bucket.blob(destination_blob_name)
-            blob.upload_from_filename(file_path)
+            blob.cache_control = self.CACHE_CONTROL  # Sent with the upload, no extra patch() call
+            if file_size > self.RESUMABLE_THRESHOLD:
+                blob.chunk_size = self.RESUMABLE_CHUNK_SIZE
+            with self._upload_slots:
+                if file_size > self.PARALLEL_UPLOAD_THRESHOLD:
+                    # Split large files into parts uploaded side by side (XML multipart upload)
+                    transfer_manager.upload_chunks_concurrently(
+                        file_path, blob,
+                        chunk_size=self.PARALLEL_CHUNK_SIZE,
+                        max_workers=self.PARALLEL_UPLOAD_WORKERS,
+                        worker_type=transfer_manager.THREAD
+                    )
+                else:
+                    blob.upload_from_filename(file_path, timeout=self.UPLOAD_TIMEOUT, retry=DEFAULT_RETRY)
             return True
         except Exception as e:
             logger.exception(f"Upload failed for {destination_blob_name}: {e}")
             return False
     
+    def upload_file_async(self, file_path: str, destination_blob_name: str) -> Future:
+        """
+        Upload a file to GCS bucket in the background, retrying with backoff.
+        
+        Args:
+            file_path: Local path to the file
+            destination_blob_name: Name of the blob in GCS
+            
+        Returns:
+            Future: Resolves to True if the upload eventually succeeded
+        """
+        return self._upload_pool.submit(self._upload_with_retry, file_path, destination_blob_name)
+    
+    def _upload_with_retry(self, file_path: str, destination_blob_name: str) -> bool:
+        """Run upload_file up to UPLOAD_ATTEMPTS times, waiting 2**attempt seconds between tries."""
+        for attempt in range(self.UPLOAD_ATTEMPTS):
+            if self.upload_file(file_path, destination_blob_name):
+                return True
+            if attempt + 1 < self.UPLOAD_ATTEMPTS:
+                time.sleep(2 ** attempt)
+        logger.error(f"Giving up on {destination_blob_name} after {self.UPLOAD_ATTEMPTS} attempts")
+        return False
+    
+    def upload_bytes(self, data: bytes, destination_blob_name: str, content_type: str = 'image/jpeg') -> bool:
+        """
+        Upload an in-memory buffer to GCS bucket.
+        
+        Args:
+            data: Bytes to upload
+            destination_blob_name: Name of the blob in GCS
+            content_type: MIME type stored on the blob
+            
+        Returns:
+            bool: True if upload was successful
+        """
+        try:
+            blob = self.bucket.blob(destination_blob_name)
+            blob.cache_control = self.CACHE_CONTROL
+            with self._upload_slots:
+                blob.upload_from_string(data, content_type=content_type, timeout=self.UPLOAD_TIMEOUT, retry=DEFAULT_RETRY)
+            return True
+        except Exception as e:
+            logger.exception(f"Upload failed for {destination_blob_name}: {e}")
+            return False
+    
+    def public_url(self, blob_name: str) -> str:
+        """
+        Build the public URL for a blob without creating a Blob object.
+        
+        Args:
+            blob_name: Name of the blob in GCS
+            
+        Returns:
+            str: Public URL, matching Blob.public_url
+        """
+        return f"https://storage.googleapis.com/{self.bucket_name}/{quote(blob_name, safe='/~')}"
+    
+    def blob_name_from_url(self, url: str) -> Optional[str]:
+        """
+        Get the blob name for a public URL of this bucket.
+        
+        Args:
+            url: Public URL as returned by get_file_url
+            
+        Returns:
+            str: Blob name, or None if the URL points elsewhere
+        """
+        bucket_name, _, blob_name = urlparse(url).path.lstrip('/').partition('/')
+        if bucket_name != self.bucket_name or not blob_name:
+            return None
+        return unquote(blob_name)
+    
+    def download_url(self, url: str) -> bytes:
+        """
+        Download a file of this bucket by its public URL over the authenticated client.
+        
+        Args:
+            url: Public URL as returned by get_file_url
+            
+        Returns:
+            bytes: Contents of the blob
+            
+        Raises:
+            ValueError: If the URL is not in this bucket
+        """
+        blob_name = self.blob_name_from_url(url)
+        if blob_name is None:
+            raise ValueError(f"Not a URL in bucket {self.bucket_name}: {url}")
+        return self.bucket.blob(blob_name).download_as_bytes(timeout=self.DOWNLOAD_TIMEOUT, retry=DEFAULT_RETRY)
+    
     def get_recent_screenshot_urls(self, stream_id: str, count: int) -> List[str]:
         """
         Get the most recent screenshot URLs for a stream from GCS.
@@ -51,29 +280,45 @@ class GCSUtils:
             List of GCS URLs for the screenshots in chronological order (earliest first)
         """
         try:
-            blobs = list(self.bucket.list_blobs(prefix=f"screenshots/{stream_id}-"))
-            
-            # Sort by the timestamp in the filename (format: YY-MM-DD--HH--MM--SS)
-            def get_timestamp(blob):
-                filename = os.path.basename(blob.name)
-                try:
-                    # Extract timestamp from filename (format: YY-MM-DD--HH--MM--SS)
-                    timestamp_str = filename.split('-', 1)[1].rsplit('.', 1)[0]
-                    return datetime.strptime(timestamp_str, '%y-%m-%d--%H--%M--%S')
-                except:
-                    # If parsing fails, use blob creation time as fallback
-                    return blob.time_created
-            
-            # First get the most recent screenshots
-            recent_blobs = sorted(blobs, key=get_timestamp, reverse=True)[:count]
-            # Then sort them from earliest to latest
-            recent_blobs = sorted(recent_blobs, key=get_timestamp)
+            # Names start with a reverse timestamp key, so GCS's name order is newest
+            # first and a single page of `count` results is the most recent set
+            blobs = self.bucket.list_blobs(
+                prefix=screenshot_prefix(stream_id),
+                max_results=count,
+                page_size=count,
+                fields='items(name),nextPageToken'  # Only names are needed; skips the rest of the metadata
+            )
+            recent_names = [blob.name for blob in blobs]
+            recent_names.reverse()
             
-            return [blob.public_url for blob in recent_blobs]
+            return [self.public_url(name) for name in recent_names]
         except Exception as e:
             logger.exception(f"Failed to get screenshot URLs for stream {stream_id}: {e}")
             return []
     
+    def delete_blobs(self, blob_names: List[str]) -> bool:
+        """
+        Delete several blobs using batched requests instead of one RPC per blob.
+        
+        Args:
+            blob_names: Names of the blobs in GCS
+            
+        Returns:
+            bool: True if every batch was deleted successfully
+        """
+        success = True
+        for start in range(0, len(blob_names), self.BATCH_SIZE):
+            names = blob_names[start:start + self.BATCH_SIZE]
+            try:
+                # Metadata calls only; batches can't carry media uploads
+                with self.storage_client.batch():
+                    for name in names:
+                        self.bucket.blob(name).delete()
+            except Exception as e:
+                logger.exception(f"Batch delete failed for {len(names)} blobs starting at {names[0]}: {e}")
+                success = False
+        return success
+    
     def get_file_url(self, blob_name: str) -> str:
         """
         Get the public URL for a file in GCS.
@@ -84,9 +329,4 @@ class GCSUtils:
         Returns:
             str: Public URL for the file
         """
-        try:
-            blob = self.bucket.blob(blob_name)
-            return blob.public_url
-        except Exception as e:
-            logger.exception(f"Failed to get URL for {blob_name}: {e}")
-            return None
+        return self.public_url(blob_name)
@@ -1,6 +1,11 @@
 #!/usr/bin/env python
 """
 CLI tool for testing CCTV analysis functionality
+
+NOTE: this tool is dead code left over from the video-upload pipeline. The Video and
+Screenshot models, extract_screenshots and analyze_screenshot it imports no longer
+exist (analysis now runs on RTSP stream grids in api/tasks), so the module cannot be
+imported until it is ported to that pipeline.
 """
 import os
 import sys
@@ -13,6 +13,7 @@ import requests
 import logging
 import time
 from urllib.parse import urljoin
+from requests.adapters import HTTPAdapter
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, 
@@ -22,10 +23,14 @@ logger = logging.getLogger(__name__)
 # API configuration
 API_BASE_URL = 'http://localhost:8000'
 
+# Shared keep-alive session so consecutive calls reuse one connection
+SESSION = requests.Session()
+SESSION.mount('http://', HTTPAdapter(pool_connections=10, pool_maxsize=10))
+
 def health_check():
     """Check if the API is running"""
     try:
-        response = requests.get(urljoin(API_BASE_URL, '/health'))
+        response = SESSION.get(urljoin(API_BASE_URL, '/health'))
         response.raise_for_status()
         return response.json()['status'] == 'ok'
     except Exception as e:
@@ -35,7 +40,7 @@ def health_check():
 def list_videos():
     """List all videos in the system"""
     try:
-        response = requests.get(urljoin(API_BASE_URL, '/api/videos'))
+        response = SESSION.get(urljoin(API_BASE_URL, '/api/videos'))
         response.raise_for_status()
         return response.json()['videos']
     except Exception as e:
@@ -50,8 +55,8 @@ def upload_video(video_path):
     
     try:
         with open(video_path, 'rb') as f:
-            files = {'video': f}
-            response = requests.post(urljoin(API_BASE_URL, '/api/videos'), files=files)
+            files = {'video': (os.path.basename(video_path), f)}
+            response = SESSION.post(urljoin(API_BASE_URL, '/api/videos'), files=files)
         
         if response.status_code == 200:
             return response.json()
@@ -65,7 +70,7 @@ def upload_video(video_path):
 def get_screenshots(video_id):
     """Get screenshots for a video"""
     try:
-        response = requests.get(urljoin(API_BASE_URL, f'/api/video/{video_id}/screenshots'))
+        response = SESSION.get(urljoin(API_BASE_URL, f'/api/video/{video_id}/screenshots'))
         response.raise_for_status()
         return response.json()['screenshots']
     except Exception as e:
@@ -75,7 +80,7 @@ def get_screenshots(video_id):
 def analyze_screenshot(screenshot_id):
     """Analyze a screenshot with Gemini AI"""
     try:
-        response = requests.post(urljoin(API_BASE_URL, f'/api/screenshot/{screenshot_id}/analyze'))
+        response = SESSION.post(urljoin(API_BASE_URL, f'/api/screenshot/{screenshot_id}/analyze'))
         response.raise_for_status()
         return response.json()
     except Exception as e:
@@ -85,7 +90,7 @@ def analyze_screenshot(screenshot_id):
 def get_analysis(screenshot_id):
     """Get analysis results for a screenshot"""
     try:
-        response = requests.get(urljoin(API_BASE_URL, f'/api/screenshot/{screenshot_id}/analysis'))
+        response = SESSION.get(urljoin(API_BASE_URL, f'/api/screenshot/{screenshot_id}/analysis'))
         if response.status_code == 200:
             return response.json()['analysis']
         else:
@@ -1,16 +1,34 @@
 from api import create_app
+from api.utils.gcs_utils import GCSUtils
 from dotenv import load_dotenv
 import argparse
+import logging
+import threading
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+def _warm_up_gcs():
+    """Create the shared GCS client and warm it up, logging instead of raising on bad config"""
+    try:
+        GCSUtils.get().warm_up()
+    except Exception as e:
+        logger.warning(f"Skipping GCS warm-up: {e}")
+
+def warm_up_gcs():
+    """Warm the shared GCS client in the background so startup isn't delayed"""
+    threading.Thread(target=_warm_up_gcs, name='gcs-warm-up', daemon=True).start()
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--local', action='store_true', help='Store screenshots locally as well as in GCS')
     args = parser.parse_args()
 
-    # Pass config to create_app
-    app = create_app({'LOCAL_SCREENSHOT_STORAGE': args.local})
+    # Pass config to create_app (without --local the LOCAL_SCREENSHOT_STORAGE setting applies)
+    app = create_app({'LOCAL_SCREENSHOT_STORAGE': True} if args.local else None)
+    warm_up_gcs()
     app.run(host='0.0.0.0', port=8000, debug=False)  # Disable debug mode
 else:
-    app = create_app()
\ No newline at end of file
+    app = create_app()
+    warm_up_gcs()
\ No newline at end of file